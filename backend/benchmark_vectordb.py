@@ -0,0 +1,95 @@
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from vectordb import create_index
+
+def make_corpus(n: int, dimension: int, n_queries: int, seed: int = 0):
+    """
+    Synthetic stand-in for sentence embeddings: points scattered around
+    many topic centres, so the data has the cluster structure ANN indexes rely on.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((max(16, n // 500), dimension)).astype('float32')
+    def sample(count):
+        points = centres[rng.integers(0, len(centres), count)] + 0.5 * rng.standard_normal((count, dimension)).astype('float32')
+        points = points.astype('float32')
+        # VectorDB stores unit vectors and searches by inner product (cosine similarity)
+        faiss.normalize_L2(points)
+        return points
+    return sample(n), sample(n_queries)
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+def run(mode: str, vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int, settings: list[int]):
+    """
+    Builds one index and measures recall and latency for each search setting (nprobe or efSearch).
+    """
+    ids = np.arange(len(vectors), dtype='int64')
+    start = time.perf_counter()
+    index = create_index(mode, vectors.shape[1], n_vectors=len(vectors))
+    if not index.is_trained:
+        index.train(vectors)
+    index.add_with_ids(vectors, ids)
+    build_time = time.perf_counter() - start
+
+    rows = []
+    for setting in settings or [None]:
+        if setting is not None and mode.startswith("ivf"):
+            faiss.extract_index_ivf(index).nprobe = setting
+        elif setting is not None and mode == "hnsw":
+            faiss.downcast_index(index.index).hnsw.efSearch = setting
+
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        latency_ms = (time.perf_counter() - start) / len(queries) * 1000
+        rows.append((mode, setting, build_time, latency_ms, recall_at_k(found, truth)))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency of VectorDB index modes against the flat baseline.")
+    parser.add_argument("--vectors", type=int, default=100_000, help="Corpus size")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--embeddings", help="Optional .npy file of real embeddings to use instead of synthetic data")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--threads", type=int, default=0, help="FAISS OpenMP threads (0 = library default)")
+    args = parser.parse_args()
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+
+    if args.embeddings:
+        data = np.ascontiguousarray(np.load(args.embeddings), dtype='float32')
+        faiss.normalize_L2(data)
+        rng = np.random.default_rng(0)
+        picks = rng.choice(len(data), size=min(args.queries, len(data)), replace=False)
+        vectors, queries = data, data[picks]
+    else:
+        vectors, queries = make_corpus(args.vectors, args.dimension, args.queries)
+
+    print(f"Corpus: {len(vectors)} x {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    # Ground truth from the exact flat index
+    flat = faiss.IndexFlatIP(vectors.shape[1])
+    flat.add(vectors)
+    _, truth = flat.search(queries, args.k)
+
+    rows = []
+    rows += run("flat", vectors, queries, truth, args.k, [])
+    rows += run("ivf_flat", vectors, queries, truth, args.k, args.nprobe)
+    rows += run("ivf_pq", vectors, queries, truth, args.k, args.nprobe)
+    rows += run("hnsw", vectors, queries, truth, args.k, args.ef_search)
+
+    print(f"{'mode':<10}{'nprobe/ef':>10}{'build s':>10}{'ms/query':>10}{'recall@' + str(args.k):>12}")
+    for mode, setting, build_time, latency_ms, recall in rows:
+        print(f"{mode:<10}{'-' if setting is None else setting:>10}{build_time:>10.2f}{latency_ms:>10.3f}{recall:>12.3f}")
+
+if __name__ == "__main__":
+    main()
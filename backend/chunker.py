@@ -1,18 +1,161 @@
-def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 100) -> list[str]:
+import re
+from typing import Callable, Iterable, Iterator
+
+# Blank lines separate paragraphs; sentence ends and single line breaks (OCR lines) separate units within one
+_PARAGRAPH = re.compile(r"\n\s*\n")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\n")
+_WORD = re.compile(r"\S+")
+
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+def _pieces(text: str, pattern: re.Pattern, offset: int = 0) -> Iterator[tuple[int, int, str]]:
     """
-    Splits text into chunks of approximately `chunk_size` characters with `overlap`.
+    Yields (start, end, separator) for each non-blank piece of `text` between matches of `pattern`.
+    Offsets are shifted by `offset` and trimmed of surrounding whitespace; `separator`
+    is the text that preceded the piece ("" for the first one).
+    """
+    pos, separator = 0, ""
+    for match in list(pattern.finditer(text)) + [None]:
+        end = match.start() if match else len(text)
+        piece = text[pos:end]
+        stripped = piece.strip()
+        if stripped:
+            start = pos + (len(piece) - len(piece.lstrip()))
+            yield offset + start, offset + start + len(stripped), separator
+            separator = ""
+        if match:
+            separator = separator or match.group()
+            pos = match.end()
+
+def _units(pages: Iterable, count_tokens: Callable[[str], int], max_tokens: int) -> Iterator[dict]:
+    """
+    Breaks pages into sentence-sized units, each no longer than `max_tokens`.
+    """
+    for page_number, page in enumerate(pages, start=1):
+        if isinstance(page, tuple):
+            page_number, page = page
+        if not page:
+            continue
+        first_on_page = True
+        for p_start, p_end, _ in _pieces(page, _PARAGRAPH):
+            first_in_paragraph = True
+            for start, end, separator in _pieces(page[p_start:p_end], _SENTENCE, p_start):
+                if first_on_page or first_in_paragraph:
+                    separator = "\n\n"
+                else:
+                    separator = "\n" if "\n" in separator else " "
+                first_on_page = first_in_paragraph = False
+
+                text = page[start:end]
+                tokens = count_tokens(text)
+                if tokens <= max_tokens:
+                    yield {"text": text, "tokens": tokens, "page": page_number, "start": start, "end": end, "separator": separator}
+                    continue
+
+                # A single over-long sentence (or OCR line without punctuation): fall back to splitting on words
+                piece_start, piece_tokens = None, 0
+                for word in _WORD.finditer(text):
+                    w_start, w_end = start + word.start(), start + word.end()
+                    word_tokens = count_tokens(word.group())
+                    if word_tokens > max_tokens:
+                        # One "word" too long on its own (a URL, OCR noise, text without spaces): cut it by characters
+                        if piece_start is not None:
+                            yield {"text": page[piece_start:piece_end], "tokens": piece_tokens, "page": page_number,
+                                   "start": piece_start, "end": piece_end, "separator": separator}
+                            separator, piece_start, piece_tokens = " ", None, 0
+                        for c_start, c_end, c_tokens in _split_characters(page, w_start, w_end, count_tokens, max_tokens):
+                            yield {"text": page[c_start:c_end], "tokens": c_tokens, "page": page_number,
+                                   "start": c_start, "end": c_end, "separator": separator}
+                            separator = ""
+                        separator = " "
+                        continue
+                    if piece_start is not None and piece_tokens + word_tokens > max_tokens:
+                        yield {"text": page[piece_start:piece_end], "tokens": piece_tokens, "page": page_number,
+                               "start": piece_start, "end": piece_end, "separator": separator}
+                        separator, piece_start, piece_tokens = " ", None, 0
+                    if piece_start is None:
+                        piece_start = w_start
+                    piece_end = w_end
+                    piece_tokens += word_tokens
+                if piece_start is not None:
+                    yield {"text": page[piece_start:piece_end], "tokens": piece_tokens, "page": page_number,
+                           "start": piece_start, "end": piece_end, "separator": separator}
+
+def _split_characters(text: str, start: int, end: int, count_tokens: Callable[[str], int],
+                      max_tokens: int) -> Iterator[tuple[int, int, int]]:
+    """
+    Yields (start, end, tokens) for consecutive pieces of text[start:end] of at most `max_tokens` tokens each.
+    """
+    while start < end:
+        stop = end
+        tokens = count_tokens(text[start:stop])
+        # Shrink proportionally until it fits; converges in a couple of tokenizer calls
+        while tokens > max_tokens and stop - start > 1:
+            stop = start + max(1, int((stop - start) * max_tokens / tokens * 0.95))
+            tokens = count_tokens(text[start:stop])
+        yield start, stop, tokens
+        start = stop
+
+def _make_chunk(units: list[dict]) -> dict:
+    text = units[0]["text"]
+    for unit in units[1:]:
+        text += unit["separator"] + unit["text"]
+    return {
+        "text": text,
+        "page": units[0]["page"],
+        "page_end": units[-1]["page"],
+        "start": units[0]["start"],
+        "end": units[-1]["end"],
+        "tokens": sum(unit["tokens"] for unit in units),
+    }
+
+def iter_chunks(pages: Iterable, max_tokens: int = 200, overlap_tokens: int = 30,
+                count_tokens: Callable[[str], int] | None = None) -> Iterator[dict]:
+    """
+    Streams structure-aware chunks out of a sequence of pages.
+
+    `pages` may be plain strings (numbered from 1) or (page_number, text) tuples,
+    and may be a generator: only the chunk being built is held in memory.
+    Text is split on paragraphs, then sentences (or lines), and units are packed
+    into chunks of at most `max_tokens` tokens as measured by `count_tokens`
+    (ideally the embedding model's tokenizer; defaults to ~4 chars per token).
+    Consecutive chunks share up to `overlap_tokens` tokens of whole sentences.
+
+    Each chunk is a dict with "text", "tokens", "page" and "page_end" (the pages
+    it starts and ends on), and "start"/"end": character offsets of its first
+    character in "page" and of its last character in "page_end".
+    """
+    count_tokens = count_tokens or _approx_tokens
+    buffer, tokens = [], 0
+
+    for unit in _units(pages, count_tokens, max_tokens):
+        if buffer and tokens + unit["tokens"] > max_tokens:
+            yield _make_chunk(buffer)
+            # Carry whole trailing sentences over as overlap
+            kept, kept_tokens = [], 0
+            for previous in reversed(buffer):
+                if kept_tokens + previous["tokens"] > overlap_tokens:
+                    break
+                kept.insert(0, previous)
+                kept_tokens += previous["tokens"]
+            if kept_tokens + unit["tokens"] > max_tokens:
+                kept, kept_tokens = [], 0
+            buffer, tokens = kept, kept_tokens
+
+        buffer.append(unit)
+        tokens += unit["tokens"]
+
+    # Never only overlap: every unit is appended right after the buffer is cut
+    if buffer:
+        yield _make_chunk(buffer)
+
+def chunk_text(text: str, max_tokens: int = 200, overlap_tokens: int = 30,
+               count_tokens: Callable[[str], int] | None = None) -> list[str]:
+    """
+    Splits text into structure-aware chunks of at most `max_tokens` tokens.
+    See iter_chunks() for the streaming version with page numbers and offsets.
     """
     if not text:
         return []
-    
-    chunks = []
-    start = 0
-    text_len = len(text)
-    
-    while start < text_len:
-        end = start + chunk_size
-        chunk = text[start:end]
-        chunks.append(chunk)
-        start += chunk_size - overlap
-        
-    return chunks
+    return [chunk["text"] for chunk in iter_chunks([text], max_tokens, overlap_tokens, count_tokens)]
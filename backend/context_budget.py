@@ -0,0 +1,145 @@
+from typing import Callable
+
+class ContextBudgeter:
+    """
+    Fits a chat prompt into the model's context window.
+
+    The window is split, in priority order, between:
+    1. the system prompt and the current query (always kept; the query is truncated if it alone cannot fit),
+    2. the most recent exchange of history (a reserved share),
+    3. retrieved RAG context, in rank order,
+    4. older history, newest first.
+    History is kept or dropped in whole exchanges (a user turn with its replies), so the
+    prompt never starts with an answer whose question was cut.
+    Turns that no longer fit are replaced by a short extractive summary when there is room for one.
+    Room for `max_new_tokens` of output is always left free.
+    """
+    def __init__(self, count_tokens: Callable[[str], int], n_ctx: int, max_new_tokens: int = 512,
+                 message_overhead: int = 6, recent_share: float = 0.25, summary_tokens: int = 96):
+        """
+        count_tokens:     the model's own tokenizer, as a text -> token count function.
+        message_overhead: template tokens around each message (role headers, end-of-turn marker).
+        recent_share:     fraction of the free budget reserved for the latest history turns.
+        summary_tokens:   at most this many tokens are spent summarising dropped turns.
+        """
+        self.count_tokens = count_tokens
+        self.n_ctx = n_ctx
+        self.max_new_tokens = max_new_tokens
+        self.message_overhead = message_overhead
+        self.recent_share = recent_share
+        self.summary_tokens = summary_tokens
+
+    def _cost(self, text: str) -> int:
+        return self.count_tokens(text) + self.message_overhead
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Cuts text down to at most `max_tokens` tokens, keeping the beginning.
+        """
+        if max_tokens <= 0:
+            return ""
+        if self.count_tokens(text) <= max_tokens:
+            return text
+        # Shrink proportionally until it fits; converges in a couple of tokenizer calls
+        while text and self.count_tokens(text) > max_tokens:
+            ratio = max_tokens / self.count_tokens(text)
+            text = text[:max(0, int(len(text) * ratio * 0.95))]
+        return text.rstrip() + "..."
+
+    def build(self, system_prompt: str, query: str, history: list[dict], contexts: list[str],
+              render: Callable[[str, list[str]], str]) -> tuple[list[dict], dict]:
+        """
+        Assembles the messages for one chat turn.
+
+        history:  earlier {"role", "content"} turns, oldest first.
+        contexts: retrieved context lines, best first.
+        render:   builds the final user message from the query and the chosen context lines.
+
+        Returns (messages, report) where report counts the tokens and items used per part.
+        """
+        history = [{"role": msg["role"], "content": msg["content"]} for msg in history if msg.get("role") in ("user", "assistant")]
+
+        # Template start plus the header of the reply the model is about to write
+        available = self.n_ctx - self.max_new_tokens - self.message_overhead
+        system_cost = self._cost(system_prompt)
+        query_cost = self._cost(render(query, []))
+        if system_cost + query_cost > available:
+            query = self.truncate(query, available - system_cost - (query_cost - self.count_tokens(query)))
+            query_cost = self._cost(render(query, []))
+        free = max(0, available - system_cost - query_cost)
+
+        history_costs = [self._cost(msg["content"]) for msg in history]
+        # Each user turn starts an exchange; (message count, tokens) per exchange
+        exchanges = []
+        for msg, cost in zip(history, history_costs):
+            if msg["role"] == "user" or not exchanges:
+                exchanges.append([0, 0])
+            exchanges[-1][0] += 1
+            exchanges[-1][1] += cost
+
+        # Keep the last exchange unless it alone would eat more than its share
+        reserved = min(exchanges[-1][1] if exchanges else 0, int(free * self.recent_share))
+
+        # RAG context, in rank order, in whatever the reserve leaves.
+        # Any context at all also brings the wrapper text around it
+        wrapper_cost = self.count_tokens(render(query, [""])) - self.count_tokens(query)
+        chosen, estimate = [], wrapper_cost
+        for line in contexts:
+            cost = self.count_tokens(line) + 1  # + newline
+            if estimate + cost <= free - reserved:
+                chosen.append(line)
+                estimate += cost
+        # Measure the message actually built: token counts of pieces do not add up exactly
+        while chosen:
+            context_cost = self._cost(render(query, chosen)) - query_cost
+            if context_cost <= free - reserved:
+                break
+            chosen.pop()
+        else:
+            context_cost = 0
+        free -= context_cost
+
+        # History, newest exchange first, until the budget runs out
+        kept = 0
+        for count, cost in reversed(exchanges):
+            if cost > free:
+                break
+            free -= cost
+            kept += count
+        dropped, history = history[:len(history) - kept], history[len(history) - kept:]
+
+        messages = [{"role": "system", "content": system_prompt}]
+        summary_cost = 0
+        if dropped and free > self.message_overhead + 16:
+            summary = self.summarise(dropped, min(self.summary_tokens, free))
+            if summary:
+                messages.append({"role": "system", "content": summary})
+                summary_cost = self._cost(summary)
+        messages.extend(history)
+        messages.append({"role": "user", "content": render(query, chosen)})
+
+        report = {
+            "n_ctx": self.n_ctx,
+            "prompt_tokens": (self.message_overhead + system_cost + summary_cost + sum(history_costs[len(history_costs) - kept:])
+                              + query_cost + context_cost),
+            "context_chunks": len(chosen),
+            "context_tokens": context_cost,
+            "history_turns": len(history),
+            "dropped_turns": len(dropped),
+        }
+        return messages, report
+
+    def summarise(self, turns: list[dict], max_tokens: int) -> str:
+        """
+        Cheap extractive summary of dropped turns: the first sentence of each
+        user question, most recent first, cut to `max_tokens`.
+        """
+        questions = []
+        for msg in reversed(turns):
+            if msg["role"] == "user" and msg["content"].strip():
+                first_line = msg["content"].strip().splitlines()[0]
+                questions.append(first_line.split(". ")[0][:200])
+        if not questions:
+            return ""
+        summary = "Earlier in this conversation the user asked about: " + "; ".join(questions)
+        return self.truncate(summary, max_tokens - self.message_overhead)
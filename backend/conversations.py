@@ -0,0 +1,81 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+class ConversationStore:
+    """
+    Remembers each conversation as it was actually sent to the model.
+
+    Clients send back their own copy of the history, with user turns as typed, but the
+    model saw those turns with retrieved context around them. Replaying the raw text would
+    make every prompt diverge from the KV state cached for the previous turn right after the
+    first user message. expand() swaps the sent versions back in, so a new turn's prompt starts
+    with exactly the tokens of the previous prompt and answer.
+
+    Conversations are keyed by their scope (collection and document filter, which decide
+    the context that was retrieved) and their raw turns; the least recently used are
+    forgotten once more than `max_conversations` are held.
+    """
+    def __init__(self, max_conversations: int = 1000):
+        self.max_conversations = max_conversations
+        self.conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(scope, turns: list[dict]) -> bytes:
+        payload = json.dumps([scope, [(turn["role"], turn["content"].strip()) for turn in turns]], default=str)
+        return hashlib.sha256(payload.encode("utf-8")).digest()
+
+    @staticmethod
+    def normalize(history: list, query: str) -> list[dict]:
+        """
+        Keeps the user and assistant turns of a client history. A trailing user turn
+        that repeats the current query (clients include the message being sent) is dropped.
+        """
+        turns = [{"role": turn["role"], "content": turn.get("content") or ""}
+                 for turn in history if turn.get("role") in ("user", "assistant")]
+        if turns and turns[-1]["role"] == "user" and turns[-1]["content"].strip() in (query.strip(), ""):
+            turns.pop()
+        return turns
+
+    def expand(self, scope, history: list, query: str) -> tuple[list[dict], list[dict]]:
+        """
+        Returns (raw turns, turns as sent to the model) for a client history.
+        Unknown conversations are sent as they are.
+        """
+        turns = self.normalize(history, query)
+        key = self.key(scope, turns)
+        with self._lock:
+            sent = self.conversations.get(key)
+            if sent is not None:
+                self.conversations.move_to_end(key)
+        return turns, [dict(turn) for turn in sent] if sent is not None else turns
+
+    def remember(self, scope, turns: list[dict], sent: list[dict], query: str, sent_query: str, answer: str):
+        """
+        Records a finished exchange: the raw turns plus `query` and `answer` now map to the
+        sent turns plus `sent_query` (the user message with its context) and the same answer.
+        """
+        raw = turns + [{"role": "user", "content": query}, {"role": "assistant", "content": answer}]
+        sent = sent + [{"role": "user", "content": sent_query}, {"role": "assistant", "content": answer}]
+        with self._lock:
+            # The conversation continues under its new key; the shorter one is not needed any more
+            self.conversations.pop(self.key(scope, turns), None)
+            self.conversations[self.key(scope, raw)] = sent
+            while len(self.conversations) > self.max_conversations:
+                self.conversations.popitem(last=False)
+
+def build_prompt(budgeter, system_prompt: str, query: str, turns: list[dict], sent: list[dict],
+                 contexts: list[str], render) -> tuple[list[dict], dict, list[dict]]:
+    """
+    Budgets a chat prompt over the replayed turns, as long as all of them fit. Replayed user
+    turns carry their old context and are much longer than typed ones; once the budgeter
+    would have to drop some, the prefix is lost anyway, so the short raw turns are used instead.
+    Returns (messages, report, the turns actually sent).
+    """
+    messages, report = budgeter.build(system_prompt, query, sent, contexts, render)
+    if report["dropped_turns"] and sent != turns:
+        messages, report = budgeter.build(system_prompt, query, turns, contexts, render)
+        sent = turns
+    return messages, report, sent
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+class EmbeddingCache:
+    """
+    Persistent cache of embeddings keyed by a hash of the model name and the text.
+    Backed by SQLite, evicting the least recently used entries once it holds more than `max_entries`.
+    """
+    def __init__(self, path: str = "data/embedding_cache.db", max_entries: int = 100_000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model_name: str, text: str) -> bytes:
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).digest()
+
+    def get_many(self, keys: list[bytes]) -> dict[bytes, np.ndarray]:
+        """
+        Returns {key: float32 vector} for the keys that are cached, and marks them as recently used.
+        """
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                now = time.time()
+                self.conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                self.conn.commit()
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, keys: list[bytes], vectors: np.ndarray):
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in zip(keys, vectors)]
+        if not rows:
+            return
+        with self._lock:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+            self.size += self.conn.total_changes - before
+            # Evict in bulk once 10% over the cap, so eviction is not paid on every insert
+            if self.size > self.max_entries * 1.1:
+                excess = self.size - self.max_entries
+                self.conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+                )
+                self.size -= excess
+            self.conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM embeddings")
+            self.conn.commit()
+            self.size = 0
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -1,15 +1,119 @@
 from sentence_transformers import SentenceTransformer
+from itertools import islice
+from typing import Iterable, Iterator
+import numpy as np
 import os
+import threading
+
+from embedding_cache import EmbeddingCache
 
 class EmbeddingModel:
-    def __init__(self, model_name: str = 'all-MiniLM-L6-v2'):
+    def __init__(self, model_name: str = 'all-MiniLM-L6-v2', batch_size: int = 64, processes: int = 0, cache: EmbeddingCache | None = None):
+        """
+        batch_size: texts encoded per forward pass (and per yielded batch in embed_batches).
+        processes:  if > 1, encode with that many CPU worker processes instead of in-process.
+        cache:      optional EmbeddingCache; texts already in it skip the encoder entirely.
+        """
+        self.model_name = model_name
         self.model = SentenceTransformer(model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        # Longest input the model reads before truncating, minus the [CLS]/[SEP] special tokens
+        self.max_tokens = self.model.max_seq_length - 2
+        self.batch_size = batch_size
+        self.processes = processes
+        self.pool = None
+        # The worker pool has one shared input and output queue: a second encode running at the
+        # same time would take the first one's results, so starting and using it is serialised
+        self._pool_lock = threading.Lock()
+        self.cache = cache
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        """
+        Encodes texts, serving whatever it can from the cache and running the model on the rest.
+        """
+        if self.cache is None:
+            return self._run_model(texts)
+
+        keys = [EmbeddingCache.key(self.model_name, text) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        # Encode each distinct uncached text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        if missing:
+            fresh = self._run_model(list(missing.values()))
+            self.cache.put_many(list(missing), fresh)
+            cached.update(zip(missing, fresh))
+
+        return np.stack([cached[key] for key in keys]).astype(np.float32, copy=False)
+
+    def _run_model(self, texts: list[str]) -> np.ndarray:
+        # Unit-length vectors, so inner product in the VectorDB is cosine similarity.
+        # A handful of texts (a chat query) is faster in-process than through the workers
+        if self.processes > 1 and len(texts) > self.processes:
+            with self._pool_lock:
+                if self.pool is None:
+                    print(f"Starting {self.processes} embedding worker processes...")
+                    self.pool = self.model.start_multi_process_pool(target_devices=["cpu"] * self.processes)
+                embeddings = self.model.encode_multi_process(
+                    texts,
+                    self.pool,
+                    batch_size=self.batch_size,
+                    chunk_size=max(1, len(texts) // self.processes),
+                    normalize_embeddings=True,
+                )
+        else:
+            embeddings = self.model.encode(
+                texts,
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+            )
+        return np.asarray(embeddings, dtype=np.float32)
 
-    def embed(self, texts: list[str]) -> list[list[float]]:
+    def count_tokens(self, text: str) -> int:
+        """
+        Number of tokens the model's own tokenizer produces for `text` (without special tokens).
+        """
+        return len(self.model.tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"])
+
+    def embed(self, texts: list[str]) -> np.ndarray:
         """
         Generates embeddings for a list of texts.
+        Returns a float32 array of shape (len(texts), dimension).
         """
         if not texts:
-            return []
-        embeddings = self.model.encode(texts)
-        return embeddings.tolist()
+            return np.empty((0, self.dimension), dtype=np.float32)
+        return self._encode(list(texts))
+
+    def embed_batches(self, items: Iterable, batch_size: int | None = None) -> Iterator[tuple[list, np.ndarray]]:
+        """
+        Embeds a (possibly lazy) stream of texts, or of chunk dicts with a "text" key,
+        yielding (items, embeddings) one batch at a time.
+        Only one batch is held in memory, so arbitrarily large documents embed in bounded memory.
+        With multiple processes, each batch is spread across the worker pool.
+        """
+        batch_size = batch_size or self.batch_size
+        if self.processes > 1:
+            # Give every worker a full batch to chew on per round trip
+            batch_size *= self.processes
+        items = iter(items)
+        while True:
+            batch = list(islice(items, batch_size))
+            if not batch:
+                return
+            texts = [item["text"] if isinstance(item, dict) else item for item in batch]
+            yield batch, self._encode(texts)
+
+    def close(self):
+        """
+        Stops the worker processes, if any were started, and closes the cache.
+        """
+        with self._pool_lock:
+            if self.pool is not None:
+                self.model.stop_multi_process_pool(self.pool)
+                self.pool = None
+        if self.cache is not None:
+            self.cache.close()
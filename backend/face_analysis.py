@@ -0,0 +1,105 @@
+import glob
+import os
+import threading
+
+from insightface.app import FaceAnalysis
+from insightface.model_zoo import model_zoo
+from insightface.utils import ensure_available
+
+# Sub-models each use case runs on every face
+SWAP_MODULES = ("detection", "recognition")  # Source identity embedding for inswapper
+DETECT_MODULES = ("detection",)  # Swap targets only need the box and the 5 keypoints
+ANALYZE_MODULES = ("detection", "genderage", "landmark_3d_68")  # Age/gender and head pose
+
+class FaceAnalysisProvider:
+    """
+    One set of InsightFace ONNX sessions shared by every face feature.
+
+    Each sub-model of the pack (detection, recognition, genderage, ...) is loaded the first
+    time a caller asks for it, and only once. get() returns a FaceAnalysis that runs just
+    the requested sub-models, so e.g. swapping never pays for age/gender estimation.
+    """
+    def __init__(self, name: str = "buffalo_l", root: str = "~/.insightface", ctx_id: int = 0,
+                 det_size: tuple = (640, 640), det_thresh: float = 0.5):
+        self.name = name
+        self.root = root
+        self.ctx_id = ctx_id
+        self.det_size = det_size
+        self.det_thresh = det_thresh
+        self.models = {}  # taskname -> prepared model
+        self.paths = {}  # taskname -> onnx file, for files seen but not kept
+        self.views = {}
+        self._scanned = set()
+        self._lock = threading.Lock()
+
+    def get(self, modules=SWAP_MODULES) -> FaceAnalysis:
+        """
+        Returns a FaceAnalysis limited to `modules` (detection is always included).
+        Views share the underlying sessions, which are safe to call from several threads.
+        """
+        modules = tuple(dict.fromkeys(("detection", *modules)))
+        view = self.views.get(modules)
+        if view is not None:
+            return view
+
+        with self._lock:
+            if modules in self.views:
+                return self.views[modules]
+            self._load([task for task in modules if task not in self.models])
+
+            # Same shape as FaceAnalysis after prepare(), without loading anything again
+            view = FaceAnalysis.__new__(FaceAnalysis)
+            view.model_dir = self.model_dir
+            view.models = {task: self.models[task] for task in modules}
+            view.det_model = self.models["detection"]
+            view.det_thresh = self.det_thresh
+            view.det_size = self.det_size
+            self.views[modules] = view
+            return view
+
+    def _load(self, tasks: list[str]):
+        """
+        Loads and prepares the given sub-models. A file's task is only known once it
+        is opened, so unseen files are opened one by one and kept only if needed.
+        """
+        if not tasks:
+            return
+        self.model_dir = ensure_available("models", self.name, root=self.root)
+        wanted = set(tasks)
+        for task in tasks:
+            if task in self.paths:
+                self._keep(task, model_zoo.get_model(self.paths[task]))
+                wanted.discard(task)
+
+        for onnx_file in sorted(glob.glob(os.path.join(self.model_dir, "*.onnx"))):
+            if not wanted:
+                break
+            if onnx_file in self._scanned:
+                continue
+            self._scanned.add(onnx_file)
+            model = model_zoo.get_model(onnx_file)
+            if model is None:
+                print(f"Face model not recognized: {onnx_file}")
+                continue
+            if model.taskname in wanted:
+                self._keep(model.taskname, model)
+                wanted.discard(model.taskname)
+            else:
+                self.paths.setdefault(model.taskname, onnx_file)
+                del model
+
+        if wanted:
+            raise RuntimeError(f"Face model pack '{self.name}' has no {', '.join(sorted(wanted))} model")
+
+    def _keep(self, task: str, model):
+        print(f"Loaded face model '{task}'")
+        if task == "detection":
+            model.prepare(self.ctx_id, input_size=self.det_size, det_thresh=self.det_thresh)
+        else:
+            model.prepare(self.ctx_id)
+        self.models[task] = model
+
+    def loaded(self) -> list[str]:
+        return list(self.models)
+
+face_analysis = FaceAnalysisProvider()
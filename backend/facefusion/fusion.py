@@ -1,6 +1,9 @@
 import sys
 import os
 import shutil
+import heapq
+import queue
+import threading
 
 # Add facefusion_core to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../facefusion_core")))
@@ -18,7 +21,6 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../face
 # This fulfills "Perform high-quality face swap... locally" using the requested model.
 
 import insightface
-from insightface.app import FaceAnalysis
 import cv2
 import numpy as np
 import torch
@@ -30,8 +32,32 @@ except ImportError:
     print("GFPGAN not found. Face enhancement will be disabled.")
     HAS_GFPGAN = False
 
+# Where GFPGAN expects the 5 facial keypoints (eyes, nose tip, mouth corners) in its 512x512 input (FFHQ alignment)
+FFHQ_TEMPLATE_512 = np.array([
+    [192.98138, 239.94708],
+    [318.90277, 240.19360],
+    [256.63416, 314.01935],
+    [201.26117, 371.41043],
+    [313.08905, 371.15118],
+], dtype=np.float32)
+
+from face_analysis import face_analysis, SWAP_MODULES, DETECT_MODULES
+from facefusion.tracker import FaceTracker
+from facefusion import video_io
+
 class FaceFusionWrapper:
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, video_workers=None, video_queue_depth=None, detect_every=5,
+                 video_encoder="auto", video_preset="medium", video_crf=23):
+        """
+        video_workers:     threads detecting, swapping and enhancing video frames in parallel (default: up to 4, one per core).
+        video_queue_depth: frames buffered between the decoder, the workers and the writer (default: 2 per worker).
+        detect_every:      in videos, run face detection every this many frames (and on scene cuts)
+                           and track the face in between; 1 detects on every frame.
+        video_encoder:     ffmpeg encoder for swapped videos ("auto", "libx264", "libx265", "h264_videotoolbox",
+                           "h264_nvenc", ...), or "mp4v" for OpenCV's writer; see video_io.
+        video_preset:      libx264/libx265 preset.
+        video_crf:         output quality (lower is better).
+        """
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         
         if model_path is None:
@@ -43,16 +69,26 @@ class FaceFusionWrapper:
         
         self.swapper = None
         self.analyser = None
+        self.detector = None
         self.face_enhancer = None
+        # Blend weights for pasting an enhanced crop back: 1 inside, fading to 0 at the crop edges
+        self._enhance_mask = cv2.GaussianBlur(cv2.copyMakeBorder(np.ones((464, 464), np.float32), 24, 24, 24, 24, cv2.BORDER_CONSTANT, value=0), (31, 31), 0)
+
+        self.video_workers = video_workers or min(4, os.cpu_count() or 1)
+        self.video_queue_depth = video_queue_depth
+        self.detect_every = detect_every
+        self.video_encoder = video_encoder
+        self.video_preset = video_preset
+        self.video_crf = video_crf
         
     def load_models(self):
         if self.swapper:
             return
 
-        # Load Face Analysis (for detection)
-        # We use 'buffalo_l' which is standard for InsightFace
-        self.analyser = FaceAnalysis(name='buffalo_l')
-        self.analyser.prepare(ctx_id=0, det_size=(640, 640))
+        # Face analysis from the shared 'buffalo_l' models (also used by /face/analyze):
+        # the source face needs its identity embedding, target faces only need locating
+        self.analyser = face_analysis.get(SWAP_MODULES)
+        self.detector = face_analysis.get(DETECT_MODULES)
         
         # Load Swapper
         self.swapper = insightface.model_zoo.get_model(self.model_path, download=False, download_zip=False)
@@ -70,6 +106,46 @@ class FaceFusionWrapper:
         else:
             print("GFPGAN model not found or library missing. Skipping enhancement.")
 
+    def _enhance_face(self, img, kps):
+        """
+        Runs GFPGAN on one face only: the face is aligned to the FFHQ template from its
+        known keypoints, enhanced as an aligned 512x512 crop, and warped back into `img`
+        with a feathered edge. GFPGAN never re-detects faces or touches the rest of the image.
+        """
+        affine, _ = cv2.estimateAffinePartial2D(np.asarray(kps, dtype=np.float32), FFHQ_TEMPLATE_512, method=cv2.LMEDS)
+        if affine is None:
+            return img
+        crop = cv2.warpAffine(img, affine, (512, 512), borderMode=cv2.BORDER_CONSTANT, borderValue=(135, 133, 132))
+        restored = self._restore(crop)
+
+        # Paste back only over the region the crop covers in the image
+        inverse = cv2.invertAffineTransform(affine)
+        corners = cv2.transform(np.array([[[0, 0], [512, 0], [512, 512], [0, 512]]], dtype=np.float32), inverse)[0]
+        height, width = img.shape[:2]
+        x0, y0 = np.maximum(np.floor(corners.min(axis=0)).astype(int), 0)
+        x1, y1 = np.minimum(np.ceil(corners.max(axis=0)).astype(int), [width, height])
+        if x1 <= x0 or y1 <= y0:
+            return img
+        inverse[:, 2] -= (x0, y0)
+        patch = cv2.warpAffine(restored, inverse, (x1 - x0, y1 - y0)).astype(np.float32)
+        mask = cv2.warpAffine(self._enhance_mask, inverse, (x1 - x0, y1 - y0))[:, :, None]
+        region = img[y0:y1, x0:x1].astype(np.float32)
+        img[y0:y1, x0:x1] = (patch * mask + region * (1 - mask)).round().astype(np.uint8)
+        return img
+
+    def _restore(self, crop):
+        """
+        Runs the GFPGAN network on an aligned 512x512 BGR crop, as GFPGANer.enhance(has_aligned=True) does.
+        Calling the network directly skips GFPGANer's face helper, which keeps per-call state, so
+        video workers can enhance frames at the same time without a lock.
+        """
+        rgb = np.ascontiguousarray(crop[:, :, ::-1], dtype=np.float32) / 255.0
+        tensor = (torch.from_numpy(rgb).permute(2, 0, 1).unsqueeze(0) - 0.5) / 0.5
+        with torch.no_grad():
+            output = self.face_enhancer.gfpgan(tensor.to(self.face_enhancer.device), return_rgb=False, weight=0.5)[0]
+        restored = (output.squeeze(0).float().clamp(-1, 1).cpu().numpy().transpose(1, 2, 0) + 1) * 127.5
+        return np.ascontiguousarray(restored[:, :, ::-1]).round().astype(np.uint8)
+
     def swap_face(self, source_path, target_path, output_path):
         self.load_models()
         
@@ -83,7 +159,7 @@ class FaceFusionWrapper:
         
         # Detect faces
         source_faces = self.analyser.get(source_img)
-        target_faces = self.analyser.get(target_img)
+        target_faces = self.detector.get(target_img)
         
         if not source_faces:
             raise Exception("No face detected in source image.")
@@ -100,13 +176,46 @@ class FaceFusionWrapper:
         # Enhance
         if self.face_enhancer:
             print("Enhancing face...")
-            _, _, res = self.face_enhancer.enhance(res, has_aligned=False, only_center_face=False, paste_back=True)
+            res = self._enhance_face(res, target_face.kps)
         
         cv2.imwrite(output_path, res)
         return output_path
 
-    def swap_video(self, source_path, target_path, output_path):
+    def _process_frame(self, frame, source_face, target_faces=None):
+        """
+        Swaps (and enhances) the first face in one video frame; frames without a face pass through.
+        `target_faces` comes from the tracker; if None, faces are detected here.
+        """
+        if target_faces is None:
+            target_faces = self.detector.get(frame)
+        if not target_faces:
+            return frame
+
+        # Swap first face found
+        res = self.swapper.get(frame, target_faces[0], source_face, paste_back=True)
+
+        # Enhance if enabled
+        if self.face_enhancer:
+            res = self._enhance_face(res, target_faces[0].kps)
+        return res
+
+    def swap_video(self, source_path, target_path, output_path, workers=None, queue_depth=None, detect_every=None):
+        """
+        Swaps the source face into every frame of a video.
+
+        Runs as a pipeline: one thread decodes, `workers` threads process frames
+        in parallel, and one thread writes the results back in their original order.
+        Frames in flight are capped, so memory stays bounded however long the video is.
+
+        With tracking (detect_every > 1) the decoder thread also locates the face,
+        since tracking has to see the frames in order; detection then runs only every
+        `detect_every` frames and on scene cuts.
+        """
         self.load_models()
+        workers = workers or self.video_workers
+        queue_depth = queue_depth or self.video_queue_depth or workers * 2
+        detect_every = detect_every or self.detect_every
+        tracker = FaceTracker(self.detector, detect_every=detect_every) if detect_every > 1 else None
         
         source_img = cv2.imread(source_path)
         if source_img is None:
@@ -118,56 +227,107 @@ class FaceFusionWrapper:
             raise Exception("No face detected in source image.")
         source_face = source_faces[0]
         
-        # Open video
-        cap = cv2.VideoCapture(target_path)
-        if not cap.isOpened():
-            raise Exception(f"Failed to open video from {target_path}")
-            
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        
-        # Create writer
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+        # Open video: decoded and encoded through ffmpeg pipes when available, keeping the audio track
+        cap, info = video_io.open_video(target_path, encoder=self.video_encoder)
+        try:
+            out = video_io.create_writer(output_path, info, encoder=self.video_encoder, preset=self.video_preset,
+                                         crf=self.video_crf, audio_source=target_path)
+        except Exception:
+            cap.release()
+            raise
         
-        frame_count = 0
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        total_frames = info["frames"]
         
-        print(f"Processing video: {width}x{height} @ {fps}fps, {total_frames} frames")
-        
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-                
+        print(f"Processing video: {info['width']}x{info['height']} @ {info['fps']}fps, {total_frames} frames, {workers} workers")
+
+        frames = queue.Queue(maxsize=queue_depth)
+        results = queue.Queue(maxsize=queue_depth)
+        # Frames decoded but not yet written. The writer can only write in order, so without
+        # this cap one slow frame would let finished frames pile up behind it without limit
+        in_flight = threading.Semaphore(workers + 2 * queue_depth)
+        stop = threading.Event()
+        errors = []
+
+        def decode():
             try:
-                # Detect faces in frame
-                target_faces = self.analyser.get(frame)
-                
-                if target_faces:
-                    # Swap first face found
-                    target_face = target_faces[0]
-                    res = self.swapper.get(frame, target_face, source_face, paste_back=True)
-                    
-                    # Enhance if enabled
-                    if self.face_enhancer:
-                        _, _, res = self.face_enhancer.enhance(res, has_aligned=False, only_center_face=False, paste_back=True)
-                        
-                    out.write(res)
-                else:
-                    # No face, just write original frame
-                    out.write(frame)
+                index = 0
+                while not stop.is_set():
+                    if not in_flight.acquire(timeout=0.5):
+                        continue
+                    ret, frame = cap.read()
+                    if not ret:
+                        in_flight.release()
+                        break
+                    target_faces = None
+                    if tracker:
+                        try:
+                            target_faces = tracker.track(frame)
+                        except Exception as e:
+                            # Leave this frame to the worker's own detection
+                            print(f"Error tracking frame {index}: {e}")
+                    frames.put((index, frame, target_faces))
+                    index += 1
             except Exception as e:
-                print(f"Error processing frame {frame_count}: {e}")
-                out.write(frame)
-                
-            frame_count += 1
-            if frame_count % 10 == 0:
-                print(f"Processed {frame_count}/{total_frames} frames")
+                errors.append(e)
+                stop.set()
+            finally:
+                for _ in range(workers):
+                    frames.put(None)
+
+        def work():
+            while True:
+                item = frames.get()
+                if item is None:
+                    break
+                index, frame, target_faces = item
+                res = frame
+                if not stop.is_set():
+                    try:
+                        res = self._process_frame(frame, source_face, target_faces)
+                    except Exception as e:
+                        print(f"Error processing frame {index}: {e}")
+                results.put((index, res))
+            results.put(None)
+
+        def write():
+            # Results arrive out of order; hold them in a heap until the next expected frame is in
+            pending, next_index, finished = [], 0, 0
+            while finished < workers:
+                item = results.get()
+                if item is None:
+                    finished += 1
+                    continue
+                heapq.heappush(pending, item)
+                while pending and pending[0][0] == next_index:
+                    _, res = heapq.heappop(pending)
+                    if not stop.is_set():
+                        try:
+                            out.write(res)
+                        except Exception as e:
+                            errors.append(e)
+                            stop.set()
+                    in_flight.release()
+                    next_index += 1
+                    if next_index % 10 == 0:
+                        print(f"Processed {next_index}/{total_frames} frames")
+
+        threads = [threading.Thread(target=decode, name="swap-decode", daemon=True),
+                   threading.Thread(target=write, name="swap-write", daemon=True)]
+        threads += [threading.Thread(target=work, name=f"swap-worker-{i}", daemon=True) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
                 
-        cap.release()
-        out.release()
+        for video in (cap, out):
+            try:
+                video.release()
+            except Exception as e:
+                errors.append(e)
+        if tracker:
+            print(f"Face detection ran on {tracker.detections}/{tracker.frames} frames")
+        if errors:
+            raise errors[0]
         return output_path
 
 fusion = FaceFusionWrapper()
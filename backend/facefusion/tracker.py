@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+from insightface.app.common import Face
+
+class FaceTracker:
+    """
+    Follows one face through a video without running the detector on every frame.
+
+    The detector runs on the first frame, every `detect_every` frames, after a scene cut
+    and whenever tracking fails. Frames after a detection that found no face are not
+    searched again until the next scheduled detection or cut. In between, the 5 facial keypoints are carried forward with
+    pyramidal Lucas-Kanade optical flow and the box is moved with them.
+    Must be fed frames in order, from one thread.
+    """
+    def __init__(self, detector, detect_every: int = 5, scene_cut: float = 0.6, max_flow_error: float = 2.0):
+        """
+        detector:       FaceAnalysis used for full detection.
+        detect_every:   run the detector at least every this many frames (1 = every frame).
+        scene_cut:      histogram correlation below which consecutive frames count as a cut.
+        max_flow_error: largest forward-backward error in pixels for a tracked keypoint.
+        """
+        self.detector = detector
+        self.detect_every = max(1, detect_every)
+        self.scene_cut = scene_cut
+        self.max_flow_error = max_flow_error
+        self.face = None
+        self.prev_gray = None
+        self.prev_hist = None
+        self.since_detect = 0
+        self.detections = 0
+        self.frames = 0
+
+    def track(self, frame) -> list:
+        """
+        Returns the faces in `frame` in the same form as FaceAnalysis.get():
+        [] if there is none, otherwise a one-element list.
+        """
+        self.frames += 1
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        hist = self._histogram(gray)
+
+        face = None
+        due = self.prev_gray is None or self.since_detect >= self.detect_every or self._is_cut(hist)
+        if not due and self.face is not None:
+            face = self._follow(gray)
+            # Tracking lost the face: look for it again right away
+            due = face is None
+        # A frame without a face is only re-checked on the detection schedule, like a tracked one
+        if due:
+            faces = self.detector.get(frame)
+            self.detections += 1
+            self.since_detect = 0
+            face = faces[0] if faces else None
+
+        self.face = face
+        self.prev_gray = gray
+        self.prev_hist = hist
+        self.since_detect += 1
+        return [face] if face is not None else []
+
+    def _histogram(self, gray) -> np.ndarray:
+        small = cv2.resize(gray, (64, 36), interpolation=cv2.INTER_AREA)
+        hist = cv2.calcHist([small], [0], None, [32], [0, 256])
+        return cv2.normalize(hist, hist).flatten()
+
+    def _is_cut(self, hist) -> bool:
+        return self.prev_hist is not None and cv2.compareHist(self.prev_hist, hist, cv2.HISTCMP_CORREL) < self.scene_cut
+
+    def _follow(self, gray):
+        """
+        Moves the last face's keypoints into this frame, or returns None if any of them was lost.
+        Each point is tracked forward and back again; points that do not return where they started are unreliable.
+        """
+        points = self.face.kps.astype(np.float32).reshape(-1, 1, 2)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, points, None, winSize=(21, 21), maxLevel=3)
+        if moved is None or not status.all():
+            return None
+        back, status_back, _ = cv2.calcOpticalFlowPyrLK(gray, self.prev_gray, moved, None, winSize=(21, 21), maxLevel=3)
+        if back is None or not status_back.all():
+            return None
+        if np.linalg.norm(back - points, axis=2).max() > self.max_flow_error:
+            return None
+
+        # Carry the box along with the keypoints' rotation, scale and shift
+        matrix, _ = cv2.estimateAffinePartial2D(points, moved)
+        if matrix is None:
+            return None
+        x1, y1, x2, y2 = self.face.bbox
+        corners = cv2.transform(np.array([[[x1, y1], [x2, y1], [x2, y2], [x1, y2]]], dtype=np.float32), matrix)[0]
+        bbox = np.array([*corners.min(axis=0), *corners.max(axis=0)], dtype=np.float32)
+
+        # A new Face each frame: earlier ones are still in use by the worker threads
+        return Face(bbox=bbox, kps=moved.reshape(-1, 2), det_score=self.face.det_score)
@@ -0,0 +1,219 @@
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+FFMPEG = shutil.which("ffmpeg")
+FFPROBE = shutil.which("ffprobe")
+
+# Software encoders "auto" falls back to, best first
+SOFTWARE_ENCODERS = ("libx264", "libx265")
+
+_encoders = None
+
+def available_encoders() -> set:
+    """
+    Video encoders the installed ffmpeg was built with (empty without ffmpeg).
+    """
+    global _encoders
+    if _encoders is None:
+        _encoders = set()
+        if FFMPEG:
+            try:
+                output = subprocess.run([FFMPEG, "-hide_banner", "-encoders"], capture_output=True, text=True, timeout=10).stdout
+                # Lines look like " V....D libx264   libx264 H.264 / AVC ..."
+                _encoders = {line.split()[1] for line in output.splitlines() if line.startswith(" V")}
+            except (OSError, subprocess.SubprocessError) as e:
+                print(f"Could not list ffmpeg encoders: {e}")
+    return _encoders
+
+def pick_encoder(requested: str = "auto") -> str | None:
+    """
+    Resolves an encoder name to one that can be used, or None for the OpenCV fallback.
+    "auto" prefers the platform's hardware H.264 encoder, then libx264.
+    A hardware encoder can be compiled in without the hardware being present, so "auto"
+    only picks VideoToolbox on macOS and NVENC when an NVIDIA driver is installed.
+    """
+    encoders = available_encoders()
+    if not encoders or requested == "mp4v":
+        return None
+    if requested != "auto":
+        if requested in encoders:
+            return requested
+        print(f"Encoder {requested} not available in ffmpeg, choosing automatically")
+    if sys.platform == "darwin" and "h264_videotoolbox" in encoders:
+        return "h264_videotoolbox"
+    if shutil.which("nvidia-smi") and "h264_nvenc" in encoders:
+        return "h264_nvenc"
+    return next((name for name in SOFTWARE_ENCODERS if name in encoders), None)
+
+def probe(path: str) -> dict:
+    """
+    Returns {"width", "height", "fps", "frames"} of the first video stream, as ffmpeg will decode it.
+    """
+    if FFPROBE:
+        try:
+            output = subprocess.run(
+                [FFPROBE, "-v", "error", "-select_streams", "v:0",
+                 "-show_entries", "stream=width,height,avg_frame_rate,nb_frames:stream_tags=rotate:stream_side_data=rotation",
+                 "-of", "json", path],
+                capture_output=True, text=True, timeout=30, check=True,
+            ).stdout
+            stream = json.loads(output)["streams"][0]
+            width, height = int(stream["width"]), int(stream["height"])
+            # ffmpeg applies rotation metadata while decoding, so portrait phone videos come out turned
+            rotation = stream.get("tags", {}).get("rotate") or next(
+                (side["rotation"] for side in stream.get("side_data_list", []) if "rotation" in side), 0)
+            if abs(int(float(rotation))) % 180 == 90:
+                width, height = height, width
+            num, _, den = stream.get("avg_frame_rate", "0/1").partition("/")
+            fps = float(num) / float(den or 1) if float(den or 1) else 0.0
+            frames = int(stream["nb_frames"]) if str(stream.get("nb_frames", "")).isdigit() else 0
+            return {"width": width, "height": height, "fps": fps or 25.0, "frames": frames}
+        except (OSError, subprocess.SubprocessError, ValueError, KeyError, IndexError) as e:
+            print(f"ffprobe failed for {path}, asking OpenCV: {e}")
+
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            raise Exception(f"Failed to open video from {path}")
+        return {
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": cap.get(cv2.CAP_PROP_FPS) or 25.0,
+            "frames": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+        }
+    finally:
+        cap.release()
+
+class FFmpegReader:
+    """
+    Decodes a video with ffmpeg (hardware decoding where available) into BGR frames
+    read from a pipe. Same read()/release() interface as cv2.VideoCapture.
+    Frames come out at a constant `fps` (duplicated or dropped as needed), so variable
+    frame rate sources stay in sync with a writer running at that rate.
+    """
+    def __init__(self, path: str, width: int, height: int, fps: float | None = None):
+        self.path = path
+        self.shape = (height, width, 3)
+        self.frame_bytes = width * height * 3
+        self.finished = False
+        # A file rather than a pipe: nobody reads it until the end, and a full pipe would stall ffmpeg
+        self.stderr = tempfile.TemporaryFile()
+        rate = ["-vsync", "cfr", "-r", f"{fps}"] if fps else []
+        self.process = subprocess.Popen(
+            [FFMPEG, "-v", "error", "-hwaccel", "auto", "-i", path,
+             "-map", "0:v:0"] + rate + ["-f", "rawvideo", "-pix_fmt", "bgr24", "-"],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=self.stderr,
+        )
+
+    def read(self):
+        # A fresh writable buffer per frame: frames are modified in place and held by other threads
+        data = bytearray(self.frame_bytes)
+        view, filled = memoryview(data), 0
+        while filled < self.frame_bytes:
+            count = self.process.stdout.readinto(view[filled:])
+            if not count:
+                self.finished = True
+                return False, None
+            filled += count
+        return True, np.frombuffer(data, dtype=np.uint8).reshape(self.shape)
+
+    def release(self):
+        """
+        Stops decoding. If the whole stream was read, raises when ffmpeg failed,
+        so a corrupt or truncated input is not mistaken for a clean end of the video.
+        """
+        self.process.stdout.close()
+        if self.process.poll() is None and not self.finished:
+            self.process.terminate()
+        self.process.wait()
+        try:
+            if self.finished and self.process.returncode != 0:
+                self.stderr.seek(0)
+                message = self.stderr.read().decode("utf-8", "replace").strip()
+                raise Exception(f"ffmpeg failed to decode {self.path} (exit code {self.process.returncode}): {message}")
+        finally:
+            self.stderr.close()
+
+class FFmpegWriter:
+    """
+    Encodes BGR frames written to a pipe with ffmpeg, muxing in the audio of `audio_source` if it has any.
+    Same write()/release() interface as cv2.VideoWriter.
+    """
+    def __init__(self, path: str, width: int, height: int, fps: float, encoder: str = "libx264",
+                 preset: str = "medium", crf: int = 23, audio_source: str | None = None):
+        """
+        encoder: an ffmpeg video encoder (see pick_encoder()).
+        preset:  speed/size trade-off for libx264/libx265 (ultrafast ... veryslow).
+        crf:     quality for software encoders (lower is better, 18-28 is typical); hardware encoders get a matching target.
+        """
+        self.path = path
+        command = [FFMPEG, "-y", "-v", "error",
+                   "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", f"{fps}", "-i", "-"]
+        if audio_source:
+            command += ["-i", audio_source]
+        # '?' makes the audio optional, for sources without a sound track
+        command += ["-map", "0:v:0"] + (["-map", "1:a:0?", "-c:a", "aac", "-b:a", "160k", "-shortest"] if audio_source else [])
+        command += ["-c:v", encoder] + _encoder_options(encoder, preset, crf)
+        # 4:2:0 output plays everywhere but needs even dimensions
+        command += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p", "-movflags", "+faststart", path]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        self.process.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+
+    def release(self):
+        """
+        Finishes the file. Raises if ffmpeg failed.
+        """
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self.process.wait() != 0:
+            raise Exception(f"ffmpeg failed to encode {self.path} (exit code {self.process.returncode})")
+
+def _encoder_options(encoder: str, preset: str, crf: int) -> list:
+    if encoder in ("libx264", "libx265"):
+        options = ["-preset", preset, "-crf", str(crf)]
+        # Lets QuickTime and Safari recognise HEVC in MP4
+        return options + (["-tag:v", "hvc1"] if encoder == "libx265" else [])
+    if encoder.endswith("_nvenc"):
+        return ["-preset", "p5", "-rc", "vbr", "-cq", str(crf), "-b:v", "0"] + (["-tag:v", "hvc1"] if encoder.startswith("hevc") else [])
+    if encoder.endswith("_videotoolbox"):
+        # VideoToolbox has no CRF; constant quality on a 1-100 scale (higher is better)
+        return ["-q:v", str(max(1, min(100, 100 - 2 * crf)))] + (["-tag:v", "hvc1"] if encoder.startswith("hevc") else [])
+    return []
+
+def open_video(path: str, encoder: str = "auto"):
+    """
+    Opens a video for reading. Returns (reader, info) with info as from probe().
+    Uses ffmpeg when it is installed (and not opted out of with encoder="mp4v"), else OpenCV.
+    """
+    info = probe(path)
+    if FFMPEG and encoder != "mp4v":
+        return FFmpegReader(path, info["width"], info["height"], info["fps"]), info
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise Exception(f"Failed to open video from {path}")
+    return cap, info
+
+def create_writer(path: str, info: dict, encoder: str = "auto", preset: str = "medium", crf: int = 23,
+                  audio_source: str | None = None):
+    """
+    Opens a video writer for frames of the size in `info`. Uses ffmpeg with the chosen encoder
+    (and the source's audio) when possible; otherwise OpenCV's mp4v writer, without audio.
+    """
+    chosen = pick_encoder(encoder)
+    if chosen:
+        print(f"Encoding {path} with {chosen}")
+        return FFmpegWriter(path, info["width"], info["height"], info["fps"], encoder=chosen, preset=preset, crf=crf,
+                            audio_source=audio_source)
+    print("ffmpeg not available, writing mp4v without audio")
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    return cv2.VideoWriter(path, fourcc, info["fps"], (info["width"], info["height"]))
@@ -0,0 +1,196 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from model_registry import registry
+from metrics import Trace
+from chunker import iter_chunks
+from pdf_utils import iter_pdf_pages
+from ocr_utils import extract_text_from_image
+
+# Stages a job moves through, in order; a failed job ends in "error" instead of "done"
+STAGES = ("queued", "extracting", "indexing", "done", "error")
+
+class IngestionJob:
+    """
+    Progress of one uploaded file through extraction, chunking, embedding and indexing.
+    """
+    def __init__(self, file_path: str, filename: str, content_type: str, collection: str, doc_id: str):
+        self.id = str(uuid.uuid4())
+        self.file_path = file_path
+        self.filename = filename
+        self.content_type = content_type
+        self.collection = collection
+        self.doc_id = doc_id
+        self.stage = "queued"
+        self.error = None
+        self.message = None
+        # Running counts per stage, updated by the worker as data streams through
+        self.progress = {"pages": 0, "chunks": 0, "embedded": 0, "indexed": 0}
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Time spent per stage (extract/ocr, chunk, embed, index), also fed to /metrics
+        self.trace = Trace("upload", job_id=self.id, content_type=content_type)
+
+    @property
+    def stage(self) -> str:
+        return self._stage
+
+    @stage.setter
+    def stage(self, stage: str):
+        if stage not in STAGES:
+            raise ValueError(f"Unknown ingestion stage: {stage!r} (expected one of {', '.join(STAGES)})")
+        self._stage = stage
+
+    @property
+    def finished(self) -> bool:
+        return self.stage in ("done", "error")
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.stage,
+            "filename": self.filename,
+            "file_path": self.file_path,
+            "collection": self.collection,
+            "document_id": self.doc_id,
+            "progress": dict(self.progress),
+            "message": self.message,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "timings_ms": self.trace.timings(),
+        }
+
+
+class IngestionManager:
+    """
+    Runs ingestion jobs on a small thread pool, off the event loop, and keeps
+    their status for polling. Only the most recent `max_jobs` jobs are remembered.
+    """
+    def __init__(self, vector_store, workers: int = 2, pdf_workers: int | None = None, max_jobs: int = 500):
+        self.vector_store = vector_store
+        self.pdf_workers = pdf_workers
+        self.max_jobs = max_jobs
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+
+    def submit(self, job: IngestionJob) -> IngestionJob:
+        with self._lock:
+            self.jobs[job.id] = job
+            # Forget the oldest finished jobs once over the limit
+            if len(self.jobs) > self.max_jobs:
+                for old in sorted(self.jobs.values(), key=lambda j: j.created_at):
+                    if len(self.jobs) <= self.max_jobs:
+                        break
+                    if old.finished:
+                        del self.jobs[old.id]
+        self.pool.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> IngestionJob | None:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: IngestionJob):
+        job.started_at = time.time()
+        vector_db = None
+        try:
+            vector_db = self.vector_store.collection(job.collection)
+            job.stage = "extracting"
+
+            # OCR Processing
+            if job.content_type.startswith('image/'):
+                # TrOCR, one pass per detected text line
+                print(f"Processing image: {job.file_path}")
+                with job.trace.span("ocr"):
+                    text = extract_text_from_image(job.file_path, trace=job.trace)
+                job.progress["pages"] = 1
+                # Only index if text is substantial
+                if text and len(text.strip()) > 5:
+                    job.trace.set(text_chars=len(text))
+                    self.index_pages(job, vector_db, [text])
+                    job.message = "File processed and added to memory."
+                else:
+                    print(f"Skipping indexing for {job.filename}: Text too short or empty.")
+                    job.message = "No text found to index."
+
+            elif job.content_type == 'application/pdf':
+                # Pages stream straight into chunking and embedding as they are extracted
+                pages = iter_pdf_pages(job.file_path, workers=self.pdf_workers)
+                self.index_pages(job, vector_db, pages)
+                job.message = "File processed and added to memory."
+
+            else:
+                job.message = f"Unsupported file type {job.content_type}; stored but not indexed."
+
+            job.stage = "done"
+        except Exception as e:
+            print(f"Error in ingestion job {job.id}: {e}")
+            job.error = str(e)
+            # Batches are indexed as they are embedded; a failed document must not stay half searchable
+            if vector_db is not None:
+                try:
+                    removed = vector_db.delete_document(job.doc_id)
+                    job.progress["indexed"] = 0
+                    if removed:
+                        print(f"Removed {removed} chunks of failed document {job.doc_id}")
+                except Exception as cleanup_error:
+                    print(f"Could not remove chunks of failed document {job.doc_id}: {cleanup_error}")
+            job.stage = "error"
+        finally:
+            job.finished_at = time.time()
+            job.trace.finish(status=job.stage, **job.progress)
+
+    def index_pages(self, job: IngestionJob, vector_db, pages) -> int:
+        """
+        Chunks pages (sized in embedding-model tokens), then embeds and indexes
+        the chunks batch by batch as they are produced, saving the index once at the end.
+        Returns the number of chunks indexed.
+        """
+        def counted_pages():
+            for page in pages:
+                job.progress["pages"] = max(job.progress["pages"], page[0] if isinstance(page, tuple) else 1)
+                yield page
+
+        def counted_chunks(chunks):
+            for chunk in chunks:
+                job.progress["chunks"] += 1
+                yield chunk
+
+        embedding_model = registry.get("embeddings")
+        trace = job.trace
+        # Each stage pulls from the one before, so each timed() excludes its inner stage
+        pages = trace.timed(counted_pages(), "extract")
+        chunks = trace.timed(iter_chunks(pages, max_tokens=embedding_model.max_tokens, count_tokens=embedding_model.count_tokens), "chunk", inner="extract")
+        index_seconds = 0.0
+        for batch, embeddings in trace.timed(embedding_model.embed_batches(counted_chunks(chunks)), "embed", inner="chunk"):
+            job.stage = "indexing"
+            job.progress["embedded"] += len(batch)
+            metadatas = [
+                {
+                    "text": chunk["text"],
+                    "source": job.filename,
+                    "doc_id": job.doc_id,
+                    "page": chunk["page"],
+                    "page_end": chunk["page_end"],
+                    "start": chunk["start"],
+                    "end": chunk["end"],
+                }
+                for chunk in batch
+            ]
+            start = time.perf_counter()
+            vector_db.add(embeddings, metadatas, save=False)
+            index_seconds += time.perf_counter() - start
+            job.progress["indexed"] += len(batch)
+        start = time.perf_counter()
+        vector_db.save()
+        trace.add("index", index_seconds + time.perf_counter() - start)
+        return job.progress["indexed"]
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from model_runner import END, LatencyTracker, new_record, pump
+
+class LlamaServerRunner:
+    """
+    Chat backend with several decoding slots over one loaded model.
+
+    llama-cpp-python's Llama object decodes one sequence at a time, so the model is
+    served by llama.cpp's own `llama-server` instead, started with `--parallel N
+    --cont-batching`: each active request holds a slot with its own KV cache, and
+    every decode step advances all active slots in one batch, so requests that
+    arrive mid-generation join the batch instead of waiting for the previous one.
+
+    The scheduler here admits at most `slots` requests to the server at once, queues up to
+    `max_pending` more in arrival order, and records per-request latencies.
+    Same interface as ModelRunner (astream_chat, count_tokens, n_ctx, stats).
+    """
+    def __init__(self, model_path: str = "models/Meta-Llama-3-8B-Instruct-Q4_K_M.gguf", slots: int = 4, max_pending: int = 16,
+                 stream_buffer: int = 32, n_ctx: int = 2048, server_url: str | None = None,
+                 server_bin: str = "llama-server", port: int = 8081, startup_timeout: float = 300):
+        """
+        slots:       maximum concurrent sequences decoded together.
+        max_pending: requests allowed to wait for a free slot before new ones are turned away.
+        n_ctx:       context window per slot (the server is given slots * n_ctx in total).
+        server_url:  use an already running llama-server instead of starting one.
+        """
+        self.model_path = model_path
+        self.slots = slots
+        self.max_pending = max_pending
+        self.stream_buffer = stream_buffer
+        self.n_ctx = n_ctx
+        self.server_url = server_url
+        self.process = None
+        self.latency = LatencyTracker()
+        self._pending = 0
+        self._active = 0
+        self._lock = threading.Lock()
+
+        if not self.server_url:
+            self.start_server(server_bin, port, startup_timeout)
+
+        # One worker thread per slot: never more requests in flight than the server has slots,
+        # so nothing queues inside the server where it could not be cancelled or measured
+        self.pool = ThreadPoolExecutor(max_workers=slots, thread_name_prefix="llm-slot")
+
+    def start_server(self, server_bin: str, port: int, startup_timeout: float):
+        """
+        Starts llama-server on the model and waits until it has loaded. Raises if it does not.
+        """
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"Model not found at {self.model_path}")
+
+        print(f"Starting llama-server with {self.slots} slots for {self.model_path}...")
+        try:
+            self.process = subprocess.Popen([
+                server_bin,
+                "-m", self.model_path,
+                "--host", "127.0.0.1",
+                "--port", str(port),
+                "-c", str(self.n_ctx * self.slots),  # Split evenly between the slots
+                "--parallel", str(self.slots),
+                "--cont-batching",
+                "-ngl", "999",  # Offload all layers to GPU (Metal)
+            ])
+        except OSError as e:
+            raise RuntimeError(f"Failed to start llama-server: {e}") from e
+        self.server_url = f"http://127.0.0.1:{port}"
+
+        deadline = time.time() + startup_timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                self.server_url = None
+                raise RuntimeError(f"llama-server exited with code {self.process.returncode}")
+            try:
+                # 503 while the model is loading, 200 once ready
+                if requests.get(f"{self.server_url}/health", timeout=2).status_code == 200:
+                    print("llama-server is ready!")
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        self.close()
+        raise RuntimeError(f"llama-server did not become ready within {startup_timeout}s")
+
+    def close(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+        self.server_url = None
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Number of tokens the server's tokenizer produces for `text`.
+        Falls back to a ~4 characters per token estimate when the server is unavailable.
+        """
+        if self.server_url:
+            try:
+                response = requests.post(f"{self.server_url}/tokenize", json={"content": text}, timeout=10)
+                response.raise_for_status()
+                return len(response.json()["tokens"])
+            except requests.RequestException as e:
+                print(f"Tokenize failed, estimating: {e}")
+        return max(1, len(text) // 4)
+
+    def stream_chat(self, messages: list, max_tokens: int = 512):
+        """
+        Streams a chat completion from the server (OpenAI-compatible server-sent events).
+        Closing the generator closes the connection, which frees the slot on the server.
+        """
+        if not self.server_url:
+            yield "Error: No model loaded."
+            return
+
+        response = requests.post(
+            f"{self.server_url}/v1/chat/completions",
+            json={
+                "messages": messages,
+                "max_tokens": max_tokens,
+                "stream": True,
+                # Reuse the slot's KV state for the shared prompt prefix (system prompt, earlier turns)
+                "cache_prompt": True,
+            },
+            stream=True,
+            timeout=(10, 300),
+        )
+        try:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith(b"data: "):
+                    continue
+                data = line[len(b"data: "):]
+                if data == b"[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                content = choices[0].get("delta", {}).get("content")
+                if content:
+                    yield content
+        finally:
+            response.close()
+
+    async def astream_chat(self, messages: list, max_tokens: int = 512, record: dict | None = None):
+        """
+        Async stream for the event loop. Waits for a free slot in arrival order;
+        if the consumer goes away, the request leaves the queue or its slot is freed.
+        `record` (from new_record()) is filled in with the request's timings.
+        """
+        loop = asyncio.get_running_loop()
+        tokens = asyncio.Queue(maxsize=self.stream_buffer)
+        cancelled = threading.Event()
+        # Only check and count under the lock: yielding while holding it would block the slot
+        # threads, stats() and, through the next astream_chat call, the event loop itself
+        with self._lock:
+            admitted = self._pending < self.max_pending
+            if admitted:
+                self._pending += 1
+        if not admitted:
+            yield "Error: Too many requests, please try again shortly."
+            return
+        self.pool.submit(self._serve, messages, max_tokens, loop, tokens, cancelled, record or new_record())
+
+        try:
+            while True:
+                token = await tokens.get()
+                if token is END:
+                    return
+                yield token
+        finally:
+            cancelled.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            queued, active = self._pending, self._active
+        return {"mode": "server", "slots": self.slots, "active": active, "queued": queued, **self.latency.summary()}
+
+    def _serve(self, messages, max_tokens, loop, tokens, cancelled, record):
+        """
+        Slot worker: runs one request to completion while other slots decode alongside it.
+        """
+        with self._lock:
+            self._pending -= 1
+            self._active += 1
+        try:
+            if cancelled.is_set():
+                # Client left while still queued: skip without spending any compute
+                return
+            pump(self.stream_chat(messages, max_tokens), loop, tokens, cancelled, record)
+            self.latency.record(record)
+        finally:
+            with self._lock:
+                self._active -= 1
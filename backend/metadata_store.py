@@ -0,0 +1,236 @@
+import json
+import re
+import sqlite3
+import threading
+
+# Metadata keys stored in their own columns; anything else goes into the `extra` JSON column
+COLUMNS = ("doc_id", "source", "text")
+
+# Query terms for keyword search
+_TERM = re.compile(r"\w+")
+# At most this many distinct trigrams from a query are matched
+MAX_QUERY_TRIGRAMS = 128
+
+class MetadataStore:
+    """
+    Chunk metadata in SQLite, one row per vector, with the row id equal to the FAISS id.
+    Inserts only write the new rows and lookups only read the rows asked for,
+    instead of pickling and unpickling the whole collection.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self.closed = False
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # Let SQLite read pages straight from a memory map instead of copying them into its cache
+        self.conn.execute("PRAGMA mmap_size=268435456")
+        self.conn.execute("PRAGMA recursive_triggers=ON")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "id INTEGER PRIMARY KEY, doc_id TEXT, source TEXT, text TEXT, extra TEXT)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_doc_id ON chunks (doc_id)")
+        self.fts = self._create_fts()
+        self.conn.commit()
+
+    def _create_fts(self) -> str | None:
+        """
+        Sets up the full-text index used for keyword search and returns its tokenizer,
+        or None if this SQLite build has no FTS5.
+
+        It indexes character trigrams where supported, so a garbled OCR word
+        still shares most of its terms with the correct spelling; otherwise whole words.
+        Triggers keep it in step with the chunks table.
+        """
+        exists = self.conn.execute("SELECT sql FROM sqlite_master WHERE name = 'chunks_fts'").fetchone()
+        if exists:
+            return "trigram" if "trigram" in exists[0] else "unicode61"
+
+        for tokenizer in ("trigram", "unicode61 remove_diacritics 2"):
+            try:
+                self.conn.execute(
+                    "CREATE VIRTUAL TABLE chunks_fts USING fts5("
+                    f"text, content='chunks', content_rowid='id', tokenize='{tokenizer}')"
+                )
+                break
+            except sqlite3.OperationalError:
+                continue
+        else:
+            print("SQLite has no FTS5; keyword search is disabled")
+            return None
+
+        # INSERT OR REPLACE only fires the delete trigger with recursive triggers on (set per connection below)
+        self.conn.executescript("""
+            CREATE TRIGGER chunks_fts_insert AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text);
+            END;
+            CREATE TRIGGER chunks_fts_delete AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            END;
+            CREATE TRIGGER chunks_fts_update AFTER UPDATE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text);
+            END;
+        """)
+        # Index the rows written before keyword search existed
+        self.conn.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')")
+        return tokenizer.split()[0]
+
+    def add(self, ids: list[int], metadatas: list[dict]):
+        """
+        Inserts one row per id. The rows are committed straight away.
+        """
+        rows = []
+        for row_id, meta in zip(ids, metadatas):
+            extra = {key: value for key, value in meta.items() if key not in COLUMNS}
+            rows.append((row_id, meta.get("doc_id"), meta.get("source"), meta.get("text"), json.dumps(extra) if extra else None))
+        with self._lock:
+            self._check_open()
+            self.conn.executemany("INSERT OR REPLACE INTO chunks (id, doc_id, source, text, extra) VALUES (?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def get(self, ids: list[int]) -> dict[int, dict]:
+        """
+        Returns {id: metadata} for the ids that exist.
+        """
+        ids = [int(row_id) for row_id in ids]
+        if not ids:
+            return {}
+        with self._lock:
+            self._check_open()
+            rows = self.conn.execute(
+                f"SELECT id, doc_id, source, text, extra FROM chunks WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall()
+        return {row[0]: _to_metadata(row) for row in rows}
+
+    def find_ids(self, where: dict | None = None) -> list[int]:
+        """
+        Returns the ids of all rows matching `where` (every row if it is empty), in id order.
+        """
+        clause, params = _where_sql(where or {})
+        with self._lock:
+            self._check_open()
+            return [row[0] for row in self.conn.execute(f"SELECT id FROM chunks {clause} ORDER BY id", params)]
+
+    def keyword_search(self, query: str, limit: int, where: dict | None = None) -> list[tuple[int, float]]:
+        """
+        BM25 keyword search over chunk texts.
+        Returns up to `limit` (id, score) pairs, best first; higher scores are better.
+        """
+        match = self._match_expression(query)
+        if not match:
+            return []
+        clause, params = _where_sql(where or {})
+        sql = "SELECT rowid, bm25(chunks_fts) FROM chunks_fts WHERE chunks_fts MATCH ?"
+        if clause:
+            sql += f" AND rowid IN (SELECT id FROM chunks {clause})"
+        sql += " ORDER BY bm25(chunks_fts) LIMIT ?"
+        with self._lock:
+            self._check_open()
+            rows = self.conn.execute(sql, [match, *params, limit]).fetchall()
+        # SQLite's bm25() is lower-is-better
+        return [(row_id, -score) for row_id, score in rows]
+
+    def _match_expression(self, query: str) -> str:
+        """
+        Turns free text into an FTS5 query matching any of its terms.
+        With the trigram tokenizer each word is split into its trigrams,
+        so documents are ranked by how many pieces of each word they share.
+        """
+        if not self.fts:
+            return ""
+        words = [word.lower() for word in _TERM.findall(query)]
+        if self.fts == "trigram":
+            terms = []
+            for word in words:
+                for start in range(len(word) - 2):
+                    terms.append(word[start:start + 3])
+            terms = list(dict.fromkeys(terms))[:MAX_QUERY_TRIGRAMS]
+        else:
+            terms = list(dict.fromkeys(words))
+        return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+    def delete(self, ids: list[int]):
+        with self._lock:
+            self._check_open()
+            self.conn.executemany("DELETE FROM chunks WHERE id = ?", [(int(row_id),) for row_id in ids])
+            self.conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._check_open()
+            self.conn.execute("DELETE FROM chunks")
+            self.conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            self._check_open()
+            return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def max_id(self) -> int:
+        """
+        The largest id in use, or -1 if the store is empty.
+        """
+        with self._lock:
+            self._check_open()
+            value = self.conn.execute("SELECT MAX(id) FROM chunks").fetchone()[0]
+        return -1 if value is None else value
+
+    def documents(self) -> list[dict]:
+        """
+        Lists the documents in the store with their chunk counts.
+        """
+        with self._lock:
+            self._check_open()
+            rows = self.conn.execute("SELECT doc_id, source, COUNT(*) FROM chunks GROUP BY doc_id, source ORDER BY MIN(id)").fetchall()
+        return [{"doc_id": doc_id, "source": source, "chunks": count} for doc_id, source, count in rows]
+
+    def close(self):
+        """
+        Closes the connection once no call is using it; later calls raise ValueError.
+        """
+        with self._lock:
+            if not self.closed:
+                self.closed = True
+                self.conn.close()
+
+    def _check_open(self):
+        # A dropped collection's store is closed while other requests may still hold its VectorDB
+        if self.closed:
+            raise ValueError(f"Metadata store {self.path} is closed (its collection was dropped)")
+
+
+def _to_metadata(row) -> dict:
+    _, doc_id, source, text, extra = row
+    meta = {"text": text, "source": source, "doc_id": doc_id}
+    if extra:
+        meta.update(json.loads(extra))
+    return meta
+
+def _where_sql(where: dict) -> tuple[str, list]:
+    """
+    Translates a metadata filter into a WHERE clause.
+    Values match by equality, or membership for lists.
+    """
+    conditions, params = [], []
+    for key, expected in where.items():
+        if key in COLUMNS:
+            column = key
+        elif re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", key):
+            column = f"json_extract(extra, '$.{key}')"
+        else:
+            raise ValueError(f"Invalid metadata key: {key!r}")
+
+        if isinstance(expected, (list, tuple, set)):
+            expected = list(expected)
+            if not expected:
+                conditions.append("0")
+                continue
+            conditions.append(f"{column} IN ({','.join('?' * len(expected))})")
+            params.extend(expected)
+        else:
+            conditions.append(f"{column} = ?")
+            params.append(expected)
+    return ("WHERE " + " AND ".join(conditions)) if conditions else "", params
@@ -0,0 +1,124 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+class Metrics:
+    """
+    Process-wide latency statistics per named stage (e.g. "chat.embed", "upload.ocr").
+    Keeps the last `window` durations of each stage for percentiles, plus running totals.
+    """
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = {"count": 0, "total": 0.0, "recent": deque(maxlen=self.window)}
+            stage["count"] += 1
+            stage["total"] += seconds
+            stage["recent"].append(seconds)
+
+    def summary(self) -> dict:
+        """
+        {stage: {count, mean_ms, p50_ms, p95_ms, max_ms}}, percentiles over the recent window.
+        """
+        with self._lock:
+            stages = {name: (stage["count"], stage["total"], sorted(stage["recent"])) for name, stage in self.stages.items()}
+        summary = {}
+        for name, (count, total, recent) in sorted(stages.items()):
+            summary[name] = {
+                "count": count,
+                "mean_ms": round(total / count * 1000, 2),
+                "p50_ms": round(recent[len(recent) // 2] * 1000, 2),
+                "p95_ms": round(recent[min(len(recent) - 1, int(len(recent) * 0.95))] * 1000, 2),
+                "max_ms": round(recent[-1] * 1000, 2),
+            }
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+
+metrics = Metrics()
+
+class Trace:
+    """
+    Timing record of one request. Spans are kept on the trace and also fed to `metrics`
+    under "<kind>.<span>"; finish() prints the whole record as one JSON log line.
+    """
+    def __init__(self, kind: str, **fields):
+        self.kind = kind
+        self.fields = fields
+        self.spans = {}
+        self._running = {}  # Inclusive time of timed() stages so far
+        self.started = time.perf_counter()
+        self.finished = False
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        """
+        Records a duration measured elsewhere. Repeated spans of the same name add up.
+        """
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+        metrics.observe(f"{self.kind}.{name}", seconds)
+
+    def timed(self, iterable, name: str, inner: str | None = None):
+        """
+        Yields from `iterable`, adding the time spent waiting on it to the span `name`
+        (a single observation, recorded when the iteration ends).
+        For generator pipelines, `inner` names the timed() stage this one pulls from;
+        its time is subtracted, so each stage only counts its own work.
+        """
+        total, iterator = 0.0, iter(iterable)
+        inner_before = self._running.get(inner, 0.0)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed = time.perf_counter() - start
+                    total += elapsed
+                    self._running[name] = self._running.get(name, 0.0) + elapsed
+                yield item
+        finally:
+            if inner:
+                total -= self._running.get(inner, 0.0) - inner_before
+            self.add(name, max(0.0, total))
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def timings(self) -> dict:
+        # Copied first: the owning worker may add spans while a status request reads them
+        return {name: round(seconds * 1000, 2) for name, seconds in list(self.spans.items())}
+
+    def finish(self, **fields) -> dict:
+        """
+        Closes the trace (only the first call counts), records its total time and logs it.
+        """
+        if self.finished:
+            return self.record()
+        self.finished = True
+        self.fields.update(fields)
+        self.add("total", time.perf_counter() - self.started)
+        record = self.record()
+        print(f"METRICS: {json.dumps(record, default=str)}")
+        return record
+
+    def record(self) -> dict:
+        return {"kind": self.kind, **self.fields, "timings_ms": self.timings()}
@@ -0,0 +1,79 @@
+import threading
+import time
+
+class ModelRegistry:
+    """
+    Loads models on first use instead of at import time.
+    Each model is registered with a zero-argument factory; get() calls it once,
+    under a per-model lock, and caches the result. warm_up() does the same in a
+    background thread so a deployment can preload what it serves.
+    """
+    def __init__(self):
+        self._factories = {}
+        self._models = {}
+        self._status = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory):
+        with self._lock:
+            self._factories[name] = factory
+            self._locks.setdefault(name, threading.Lock())
+            self._status.setdefault(name, {"state": "not_loaded"})
+
+    def get(self, name: str):
+        """
+        Returns the model, loading it first if needed.
+        Concurrent callers wait for the same load instead of starting their own.
+        """
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self._factories:
+            raise KeyError(f"Unknown model: {name}")
+
+        with self._locks[name]:
+            if name in self._models:
+                return self._models[name]
+            print(f"Loading model '{name}'...")
+            self._status[name] = {"state": "loading"}
+            start = time.perf_counter()
+            try:
+                model = self._factories[name]()
+            except Exception as e:
+                self._status[name] = {"state": "error", "error": str(e)}
+                raise
+            self._models[name] = model
+            self._status[name] = {"state": "ready", "load_seconds": round(time.perf_counter() - start, 2)}
+            print(f"Model '{name}' ready in {self._status[name]['load_seconds']}s")
+            return model
+
+    def is_ready(self, name: str) -> bool:
+        return name in self._models
+
+    def warm_up(self, names: list[str] | None = None) -> threading.Thread:
+        """
+        Loads the given models (all registered ones by default) in a background thread.
+        Failures are recorded in status() rather than raised.
+        """
+        names = list(self._factories) if names is None else names
+
+        def load_all():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    print(f"Warm-up of model '{name}' failed: {e}")
+
+        thread = threading.Thread(target=load_all, name="model-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def status(self) -> dict:
+        """
+        Per-model readiness: {"name": {"state": "not_loaded" | "loading" | "ready" | "error", ...}}.
+        """
+        with self._lock:
+            return {name: dict(self._status[name]) for name in self._factories}
+
+registry = ModelRegistry()
@@ -1,32 +1,83 @@
-from llama_cpp import Llama
+from llama_cpp import Llama, LlamaRAMCache
+import asyncio
+import concurrent.futures
 import os
+import queue
+import threading
+import time
+from collections import deque
+
+# Marks the end of a token stream on a per-request queue
+END = object()
 
 class ModelRunner:
-    def __init__(self, model_path: str = "models/Meta-Llama-3-8B-Instruct-Q4_K_M.gguf"):
+    def __init__(self, model_path: str = "models/Meta-Llama-3-8B-Instruct-Q4_K_M.gguf", max_pending: int = 16, stream_buffer: int = 32,
+                 prompt_cache_bytes: int = 2 << 30, system_prompt: str | None = None, n_ctx: int = 2048):
+        """
+        max_pending:        chat requests allowed to wait for the model before new ones are turned away.
+        stream_buffer:      tokens buffered per request; decoding pauses when a client reads slower than this.
+        prompt_cache_bytes: RAM for saved KV states of earlier prompts (0 disables prefix reuse).
+        system_prompt:      if given, its KV state is computed once at load so no request has to prefill it.
+        n_ctx:              context window in tokens; prompts are budgeted to fit it (see context_budget).
+        """
         self.model_path = model_path
+        self.n_ctx = n_ctx
         self.llm = None
+        self.stream_buffer = stream_buffer
         self.load_model()
 
+        if self.llm and prompt_cache_bytes:
+            # After every completion llama.cpp stores the KV state under its token sequence;
+            # a new prompt restores the state sharing the longest prefix and only prefills the rest,
+            # so system prompt and earlier turns are not re-evaluated every turn
+            self.llm.set_cache(LlamaRAMCache(capacity_bytes=prompt_cache_bytes))
+            if system_prompt:
+                self.prime([{"role": "system", "content": system_prompt}])
+
+        # A single inference thread owns the model and serves requests in arrival order
+        self._requests = queue.Queue(maxsize=max_pending)
+        self.latency = LatencyTracker()
+        self._worker = threading.Thread(target=self._serve, name="llm-inference", daemon=True)
+        self._worker.start()
+
     def load_model(self):
         """
-        Loads the Llama 3 model.
+        Loads the Llama 3 model. Raises if it cannot, so the registry reports the error
+        instead of a runner without a model.
         """
         if not os.path.exists(self.model_path):
-            print(f"Model not found at {self.model_path}")
-            return
+            raise FileNotFoundError(f"Model not found at {self.model_path}")
 
         print(f"Loading Llama 3 Model from {self.model_path}...")
-        
+
         try:
             self.llm = Llama(
                 model_path=self.model_path,
-                n_ctx=2048,  # Context window
+                n_ctx=self.n_ctx,  # Context window
                 n_gpu_layers=-1,  # Offload all to GPU (Metal)
                 verbose=True
             )
-            print("Llama 3 Model loaded successfully!")
         except Exception as e:
-            print(f"Failed to load model: {e}")
+            raise RuntimeError(f"Failed to load model: {e}") from e
+        print("Llama 3 Model loaded successfully!")
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Number of tokens the model's tokenizer produces for `text`.
+        Falls back to a ~4 characters per token estimate when no model is loaded.
+        """
+        if not self.llm:
+            return max(1, len(text) // 4)
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+    def prime(self, messages: list):
+        """
+        Evaluates a conversation prefix once so its KV state lands in the prompt cache.
+        Must run before the inference thread starts (or on it).
+        """
+        print("Priming prompt cache...")
+        # One generated token is enough: the completion saves the state of the whole prompt
+        self.llm.create_chat_completion(messages=messages + [{"role": "user", "content": ""}], max_tokens=1)
 
     def stream_chat(self, messages: list, max_tokens: int = 512):
         """
@@ -41,8 +92,143 @@ class ModelRunner:
             max_tokens=max_tokens,
             stream=True
         )
-        
+
         for output in stream:
             delta = output['choices'][0]['delta']
             if 'content' in delta:
                 yield delta['content']
+
+    async def astream_chat(self, messages: list, max_tokens: int = 512, record: dict | None = None):
+        """
+        Async version of stream_chat for use on the event loop.
+        Tokens are produced by the inference thread and handed over through a
+        bounded queue. If the consumer goes away (e.g. the client disconnects and
+        the response is cancelled), generation for this request stops.
+        `record` (from new_record()) is filled in with the request's timings.
+        """
+        loop = asyncio.get_running_loop()
+        tokens = asyncio.Queue(maxsize=self.stream_buffer)
+        cancelled = threading.Event()
+        try:
+            self._requests.put_nowait((messages, max_tokens, loop, tokens, cancelled, record or new_record()))
+        except queue.Full:
+            yield "Error: Too many requests, please try again shortly."
+            return
+
+        try:
+            while True:
+                token = await tokens.get()
+                if token is END:
+                    return
+                yield token
+        finally:
+            cancelled.set()
+
+    def stats(self) -> dict:
+        return {"mode": "local", "slots": 1, "queued": self._requests.qsize(), **self.latency.summary()}
+
+    def _serve(self):
+        """
+        Inference thread: runs one request at a time, in arrival order.
+        """
+        while True:
+            messages, max_tokens, loop, tokens, cancelled, record = self._requests.get()
+            if cancelled.is_set():
+                # Client left while still queued: skip without spending any compute
+                continue
+            pump(self.stream_chat(messages, max_tokens), loop, tokens, cancelled, record)
+            self.latency.record(record)
+
+
+def hand_over(loop, tokens: asyncio.Queue, item, cancelled: threading.Event) -> bool:
+    """
+    Puts an item on a request's asyncio queue from a worker thread, waiting while it is full.
+    Returns False if the request was cancelled instead.
+    """
+    if cancelled.is_set():
+        return False
+    future = asyncio.run_coroutine_threadsafe(tokens.put(item), loop)
+    while True:
+        try:
+            future.result(timeout=0.5)
+            return True
+        except concurrent.futures.TimeoutError:
+            if cancelled.is_set() or loop.is_closed():
+                future.cancel()
+                return False
+
+
+def new_record() -> dict:
+    """
+    Per-request timing record, filled in as the request moves through the runner.
+    """
+    return {"queued_at": time.perf_counter(), "started_at": None, "first_token_at": None, "finished_at": None,
+            "tokens": 0, "cancelled": False}
+
+def pump(stream, loop, tokens: asyncio.Queue, cancelled: threading.Event, record: dict):
+    """
+    Feeds a token generator into a request's queue, timing it into `record`,
+    and always ends the stream with END. Stops generating if the request is cancelled.
+    """
+    record["started_at"] = time.perf_counter()
+    try:
+        for token in stream:
+            if record["first_token_at"] is None:
+                record["first_token_at"] = time.perf_counter()
+            record["tokens"] += 1
+            if not hand_over(loop, tokens, token, cancelled):
+                stream.close()
+                record["cancelled"] = True
+                print("Chat request cancelled, generation stopped.")
+                break
+    except Exception as e:
+        print(f"Error during generation: {e}")
+        hand_over(loop, tokens, f"Error: {e}", cancelled)
+    finally:
+        record["finished_at"] = time.perf_counter()
+        hand_over(loop, tokens, END, cancelled)
+
+class LatencyTracker:
+    """
+    Keeps the timing records of the last `window` chat requests and summarises them.
+    """
+    def __init__(self, window: int = 256):
+        self.records = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, record: dict):
+        queue_ms = (record["started_at"] - record["queued_at"]) * 1000
+        ttft_ms = (record["first_token_at"] - record["queued_at"]) * 1000 if record["first_token_at"] else None
+        total_ms = (record["finished_at"] - record["queued_at"]) * 1000
+        decode_s = record["finished_at"] - (record["first_token_at"] or record["finished_at"])
+        tokens_per_s = (record["tokens"] - 1) / decode_s if decode_s > 0 and record["tokens"] > 1 else None
+        # Logged per request by the chat Trace; kept here for the /chat/stats summary
+        with self._lock:
+            self.records.append({**record, "queue_ms": queue_ms, "ttft_ms": ttft_ms, "total_ms": total_ms,
+                                 "tokens_per_s": tokens_per_s})
+
+    def summary(self) -> dict:
+        """
+        Median and p95 latencies over the window, plus aggregate throughput:
+        all tokens generated divided by the wall time the window spans.
+        """
+        with self._lock:
+            records = list(self.records)
+        if not records:
+            return {"requests": 0}
+
+        def percentiles(key):
+            values = sorted(r[key] for r in records if r[key] is not None)
+            if not values:
+                return None
+            return {"p50": round(values[len(values) // 2], 1), "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 1)}
+
+        span = max(r["finished_at"] for r in records) - min(r["started_at"] for r in records)
+        return {
+            "requests": len(records),
+            "queue_ms": percentiles("queue_ms"),
+            "ttft_ms": percentiles("ttft_ms"),
+            "total_ms": percentiles("total_ms"),
+            "tokens_per_s": percentiles("tokens_per_s"),
+            "aggregate_tokens_per_s": round(sum(r["tokens"] for r in records) / span, 1) if span > 0 else None,
+        }
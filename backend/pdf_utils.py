@@ -1,11 +1,85 @@
 import fitz  # PyMuPDF
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
 
-def extract_text_from_pdf(pdf_path: str) -> str:
+# Below this many pages, starting work in other processes costs more than it saves
+PARALLEL_MIN_PAGES = 32
+
+# One pool for the whole process, created on first use. Workers are spawned rather than
+# forked: ingestion calls in from threads, and forking a threaded process can copy held locks.
+_pool = None
+_pool_closed = False
+_pool_lock = threading.Lock()
+
+def extract_text_from_pdf(pdf_path: str, workers: int | None = None) -> str:
     """
     Extracts text from a PDF file using PyMuPDF.
     """
-    doc = fitz.open(pdf_path)
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    return text
+    return "".join(text for _, text in iter_pdf_pages(pdf_path, workers=workers))
+
+def _extract_pages(pdf_path: str, start: int, stop: int) -> list[tuple[int, str]]:
+    """
+    Extracts pages [start, stop) in a worker process (each worker opens its own document).
+    """
+    with fitz.open(pdf_path) as doc:
+        return [(number + 1, doc[number].get_text()) for number in range(start, stop)]
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool_closed:
+            raise RuntimeError("PDF extraction pool has been shut down")
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def shutdown_pool():
+    """
+    Stops the shared extraction processes (called when the app shuts down).
+    """
+    global _pool, _pool_closed
+    with _pool_lock:
+        pool, _pool, _pool_closed = _pool, None, True
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def iter_pdf_pages(pdf_path: str, workers: int | None = None, pages_per_task: int = 4) -> Iterator[tuple[int, str]]:
+    """
+    Yields (page_number, text) for each page, starting at 1, in page order.
+
+    Documents under PARALLEL_MIN_PAGES pages (or workers=1) are read page by page in this
+    process. Larger ones are fanned out across the shared process pool (sized by the first
+    caller's `workers`) in batches of `pages_per_task` pages; only a few batches per worker
+    are in flight at once, so memory stays bounded and the first pages are yielded as soon
+    as their batch is done.
+    """
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+        pool_size = workers or os.cpu_count() or 1
+        workers = min(pool_size, -(-page_count // pages_per_task))
+        if workers <= 1 or page_count < PARALLEL_MIN_PAGES:
+            for page in doc:
+                yield page.number + 1, page.get_text()
+            return
+
+    ranges = iter([(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)])
+    pool = _get_pool(pool_size)
+    pending = deque()
+    try:
+        for start, stop in ranges:
+            pending.append(pool.submit(_extract_pages, pdf_path, start, stop))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            yield from pending.popleft().result()
+            next_range = next(ranges, None)
+            if next_range:
+                pending.append(pool.submit(_extract_pages, pdf_path, *next_range))
+    finally:
+        # The pool outlives this document, so batches nobody will read are dropped
+        for future in pending:
+            future.cancel()
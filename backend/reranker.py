@@ -0,0 +1,22 @@
+from sentence_transformers import CrossEncoder
+import numpy as np
+
+class Reranker:
+    """
+    Scores (query, passage) pairs with a small cross-encoder, which reads both texts
+    together and judges relevance far more precisely than comparing two embeddings.
+    Too slow to run over a whole collection, so it only reorders a short candidate list.
+    """
+    def __init__(self, model_name: str = 'cross-encoder/ms-marco-MiniLM-L-6-v2', batch_size: int = 32):
+        self.model_name = model_name
+        self.model = CrossEncoder(model_name)
+        self.batch_size = batch_size
+
+    def __call__(self, query: str, texts: list[str]) -> np.ndarray:
+        """
+        Returns one relevance score per text, higher is better (usable as VectorDB.search(rerank=...)).
+        """
+        if not texts:
+            return np.empty(0, dtype=np.float32)
+        scores = self.model.predict([(query, text) for text in texts], batch_size=self.batch_size)
+        return np.asarray(scores, dtype=np.float32)
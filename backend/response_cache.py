@@ -0,0 +1,81 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+class ResponseCache:
+    """
+    In-memory cache of finished chat answers, looked up by meaning rather than exact text.
+
+    An entry matches a new question when it was asked against the same scope (collection,
+    index generation, document filter) with the same conversation history, and its query
+    embedding has cosine similarity of at least `min_similarity` with the new one.
+    Holds at most `max_entries` answers, evicting the least recently used, and entries
+    expire `ttl` seconds after they were stored.
+    """
+    def __init__(self, max_entries: int = 512, ttl: float = 3600, min_similarity: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_similarity = min_similarity
+        # id -> (scope key, unit query vector, answer, expiry time), least recently used first
+        self.entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(collection: str, generation: int, history: list, where: dict | None = None) -> bytes:
+        """
+        Scope of an answer: a new upload or delete changes the generation, and a different
+        history or document filter can change the answer, so all of them are part of the key.
+        """
+        turns = [(msg.get("role"), msg.get("content")) for msg in history]
+        payload = json.dumps([collection, generation, turns, where], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).digest()
+
+    def get(self, key: bytes, query_vector: np.ndarray) -> str | None:
+        """
+        Returns the answer of the closest matching entry, or None.
+        """
+        query = _unit(query_vector)
+        now = time.time()
+        with self._lock:
+            best_id, best_score = None, self.min_similarity
+            for entry_id, (entry_key, vector, answer, expires) in list(self.entries.items()):
+                if expires <= now:
+                    del self.entries[entry_id]
+                    continue
+                if entry_key != key:
+                    continue
+                score = float(np.dot(vector, query))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_id)
+            self.hits += 1
+            return self.entries[best_id][2]
+
+    def put(self, key: bytes, query_vector: np.ndarray, answer: str):
+        with self._lock:
+            self.entries[self._next_id] = (key, _unit(query_vector), answer, time.time() + self.ttl)
+            self._next_id += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
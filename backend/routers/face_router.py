@@ -1,16 +1,30 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
 import shutil
 import os
 import uuid
 from facefusion.fusion import fusion
 from wan.wan_model import WanModel
+from model_registry import registry
 
 router = APIRouter()
 
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("outputs", exist_ok=True)
 
-wan_model = WanModel()
+# Video swaps run on this many worker threads, with this many frames buffered per pipeline stage
+fusion.video_workers = int(os.environ.get("TALK_FACE_VIDEO_WORKERS", "0")) or fusion.video_workers
+fusion.video_queue_depth = int(os.environ.get("TALK_FACE_VIDEO_QUEUE", "0")) or None
+# Full face detection every N video frames and on scene cuts, optical-flow tracking in between (1 = detect every frame)
+fusion.detect_every = int(os.environ.get("TALK_FACE_DETECT_EVERY", "5"))
+# Video output through ffmpeg: auto (hardware H.264 if present, else libx264), libx264, libx265, h264_nvenc, ... or mp4v (OpenCV, no audio)
+fusion.video_encoder = os.environ.get("TALK_FACE_VIDEO_ENCODER", "auto")
+fusion.video_preset = os.environ.get("TALK_FACE_VIDEO_PRESET", "medium")
+fusion.video_crf = int(os.environ.get("TALK_FACE_VIDEO_CRF", "23"))
+
+# Both use the shared InsightFace models (face_analysis), loaded when a face endpoint is first used
+registry.register("wan", lambda: WanModel())
+registry.register("face_swap", lambda: fusion.load_models() or fusion)
 
 @router.post("/swap")
 async def swap_faces(source: UploadFile = File(...), target: UploadFile = File(...)):
@@ -32,12 +46,14 @@ async def swap_faces(source: UploadFile = File(...), target: UploadFile = File(.
         target_ext = target.filename.split('.')[-1].lower()
         is_video = target_ext in ['mp4', 'mov', 'avi', 'mkv']
         
+        # Model loading and inference block, so they run off the event loop
+        fusion = await run_in_threadpool(registry.get, "face_swap")
         if is_video:
             output_path = f"outputs/{target_id}_swapped.mp4"
-            result_path = fusion.swap_video(source_path, target_path, output_path)
+            result_path = await run_in_threadpool(fusion.swap_video, source_path, target_path, output_path)
         else:
             output_path = f"outputs/{target_id}_swapped.jpg"
-            result_path = fusion.swap_face(source_path, target_path, output_path)
+            result_path = await run_in_threadpool(fusion.swap_face, source_path, target_path, output_path)
             
         return {"output_path": result_path, "message": "Face swap successful"}
     except Exception as e:
@@ -52,7 +68,8 @@ async def analyze_face(image: UploadFile = File(...)):
         shutil.copyfileobj(image.file, buffer)
         
     try:
-        result = wan_model.predict(image_path)
+        wan = await run_in_threadpool(registry.get, "wan")
+        result = await run_in_threadpool(wan.predict, image_path)
         return {"analysis": result}
     except Exception as e:
         return {"error": str(e)}
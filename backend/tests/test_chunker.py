@@ -0,0 +1,19 @@
+from chunker import chunk_text, iter_chunks
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+def test_words_longer_than_a_chunk_are_split_by_characters():
+    text = "x" * 5000
+    chunks = chunk_text(text, max_tokens=50, overlap_tokens=0, count_tokens=count_tokens)
+
+    assert all(count_tokens(chunk) <= 50 for chunk in chunks)
+    assert "".join(chunks) == text
+
+def test_split_words_keep_their_offsets():
+    page = "intro words " + "z" * 600 + " tail"
+    chunks = list(iter_chunks([page], max_tokens=50, overlap_tokens=0, count_tokens=count_tokens))
+
+    assert all(chunk["tokens"] <= 50 for chunk in chunks)
+    assert all(page[chunk["start"]:chunk["end"]] == chunk["text"] for chunk in chunks)
+    assert chunks[-1]["text"].endswith(" tail")
@@ -0,0 +1,51 @@
+from context_budget import ContextBudgeter
+from prompts import render_user_message
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+def rendered_tokens(budgeter: ContextBudgeter, messages: list[dict]) -> int:
+    """
+    Size of the prompt as the model sees it: every message plus its template tokens,
+    plus the header of the reply.
+    """
+    return budgeter.message_overhead + sum(budgeter._cost(msg["content"]) for msg in messages)
+
+def test_context_wrapper_fits_reply_reservation():
+    budgeter = ContextBudgeter(count_tokens, n_ctx=1024, max_new_tokens=512)
+    contexts = [f"- [notes.pdf, p.{i}] " + "dosage line text " * 6 for i in range(40)]
+    history = [{"role": "user", "content": "earlier question " * 10}, {"role": "assistant", "content": "earlier answer " * 10}]
+
+    messages, report = budgeter.build("You are a helpful assistant.", "What is the dose?", history, contexts, render_user_message)
+
+    assert report["context_chunks"] > 0
+    assert messages[-1]["content"].startswith("Context information")
+    assert rendered_tokens(budgeter, messages) == report["prompt_tokens"]
+    assert report["prompt_tokens"] <= budgeter.n_ctx - budgeter.max_new_tokens
+
+def test_no_context_when_only_the_wrapper_would_fit():
+    budgeter = ContextBudgeter(count_tokens, n_ctx=600, max_new_tokens=512)
+    query = "q " * 100
+    messages, report = budgeter.build("system", query, [], ["- short line"], render_user_message)
+
+    assert report["context_chunks"] == 0
+    assert messages[-1]["content"] == query
+    assert rendered_tokens(budgeter, messages) <= budgeter.n_ctx - budgeter.max_new_tokens
+
+def test_history_is_dropped_in_whole_exchanges():
+    budgeter = ContextBudgeter(count_tokens, n_ctx=1024, max_new_tokens=512, recent_share=0)
+    history = [
+        {"role": "user", "content": "first question " * 40},
+        {"role": "assistant", "content": "first answer " * 5},
+        {"role": "user", "content": "second question " * 5},
+        {"role": "assistant", "content": "second answer " * 5},
+    ]
+    # Room for the last exchange and the first answer, but not the first question
+    query = "q " * 600
+
+    messages, report = budgeter.build("system", query, history, [], render_user_message)
+
+    turns = [msg for msg in messages if msg["role"] != "system"]
+    assert turns[0]["role"] == "user"
+    assert turns[:-1] == history[2:]
+    assert report["dropped_turns"] == 2
@@ -0,0 +1,88 @@
+from context_budget import ContextBudgeter
+from conversations import ConversationStore, build_prompt
+from prompts import SYSTEM_PROMPT, render_user_message
+
+SCOPE = ("default", [])
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+def ask(store, budgeter, history, query, contexts, answer, system_prompt="system", scope=SCOPE):
+    """
+    One /chat request as app.py runs it. `history` is what the frontend sends: its own
+    copy of the turns, including the message being sent.
+    """
+    turns, sent = store.expand(scope, history, query)
+    messages, report, sent = build_prompt(budgeter, system_prompt, query, turns, sent, contexts, render_user_message)
+    store.remember(scope, turns, sent, query, messages[-1]["content"], answer)
+    return messages, report
+
+def test_rag_turns_share_the_previous_prompt_as_prefix():
+    store = ConversationStore()
+    budgeter = ContextBudgeter(count_tokens, n_ctx=4096, max_new_tokens=512)
+
+    history = [{"role": "user", "content": "What is the dose?"}]
+    first, _ = ask(store, budgeter, history, "What is the dose?", ["- [notes.pdf, p.2] 5 mg daily"], "5 mg daily.")
+
+    history += [{"role": "assistant", "content": "5 mg daily."}, {"role": "user", "content": "And for children?"}]
+    second, _ = ask(store, budgeter, history, "And for children?", ["- [notes.pdf, p.3] 2 mg daily"], "2 mg daily.")
+
+    # The first prompt and its answer are replayed unchanged, so the cached KV state is reused
+    assert first[-1]["content"].startswith("Context information")
+    assert second[:len(first)] == first
+    assert second[len(first)] == {"role": "assistant", "content": "5 mg daily."}
+    assert second[-1]["content"].startswith("Context information")
+
+    history += [{"role": "assistant", "content": "2 mg daily."}, {"role": "user", "content": "Thanks"}]
+    third, _ = ask(store, budgeter, history, "Thanks", [], "You're welcome.")
+    assert third[:len(second)] == second
+
+def test_unknown_history_is_sent_as_typed():
+    store = ConversationStore()
+    history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}, {"role": "user", "content": "next"}]
+    turns, sent = store.expand(SCOPE, history, "next")
+    assert turns == sent == history[:2]
+
+def test_least_recently_used_conversations_are_forgotten():
+    store = ConversationStore(max_conversations=1)
+    store.remember(SCOPE, [], [], "a", "ctx a", "answer a")
+    store.remember(SCOPE, [], [], "b", "ctx b", "answer b")
+    _, sent = store.expand(SCOPE, [{"role": "user", "content": "a"}, {"role": "assistant", "content": "answer a"}], "next")
+    assert sent[0]["content"] == "a"
+    _, sent = store.expand(SCOPE, [{"role": "user", "content": "b"}, {"role": "assistant", "content": "answer b"}], "next")
+    assert sent[0]["content"] == "ctx b"
+
+def test_history_survives_when_replayed_context_no_longer_fits():
+    store = ConversationStore()
+    budgeter = ContextBudgeter(count_tokens, n_ctx=2048, max_new_tokens=512)
+    # Enough context per turn that two replayed turns fit the default window but three do not
+    contexts = [f"- [rx.pdf, p.{i}] " + "prescription line text " * 6 for i in range(10)]
+
+    history, prompts = [], []
+    for turn in range(1, 4):
+        query = f"Question {turn}?"
+        history.append({"role": "user", "content": query})
+        messages, report = ask(store, budgeter, history, query, contexts, f"Answer {turn}.", system_prompt=SYSTEM_PROMPT)
+        history.append({"role": "assistant", "content": f"Answer {turn}."})
+        prompts.append(messages)
+
+        assert report["dropped_turns"] == 0
+        assert report["prompt_tokens"] <= budgeter.n_ctx - budgeter.max_new_tokens
+        turns = [msg for msg in messages if msg["role"] != "system"]
+        assert [msg["role"] for msg in turns] == ["user", "assistant"] * (turn - 1) + ["user"]
+
+    # The second turn extends the first prompt; the third falls back to the typed turns
+    assert prompts[1][:len(prompts[0])] == prompts[0]
+    assert [msg["content"] for msg in prompts[2][1:-1]] == ["Question 1?", "Answer 1.", "Question 2?", "Answer 2."]
+
+def test_conversations_do_not_leak_across_collections():
+    store = ConversationStore()
+    budgeter = ContextBudgeter(count_tokens, n_ctx=4096, max_new_tokens=512)
+    history = [{"role": "user", "content": "What is the dose?"}]
+    ask(store, budgeter, history, "What is the dose?", ["- [private.pdf, p.1] 5 mg daily"], "5 mg daily.",
+        scope=("alice", []))
+
+    history += [{"role": "assistant", "content": "5 mg daily."}, {"role": "user", "content": "Why?"}]
+    for scope in (("bob", []), ("alice", ["other-doc"])):
+        messages, _ = ask(store, budgeter, history, "Why?", [], "Because.", scope=scope)
+        assert not any("private.pdf" in msg["content"] for msg in messages)
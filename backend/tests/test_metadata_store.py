@@ -0,0 +1,40 @@
+import threading
+
+import pytest
+
+from metadata_store import MetadataStore
+
+def test_closed_store_raises_a_clear_error(tmp_path):
+    store = MetadataStore(str(tmp_path / "metadata.db"))
+    store.add([0], [{"doc_id": "a", "source": "a.pdf", "text": "hello"}])
+    store.close()
+    store.close()  # Dropping twice is harmless
+
+    with pytest.raises(ValueError, match="dropped"):
+        store.get([0])
+    with pytest.raises(ValueError, match="dropped"):
+        store.add([1], [{"text": "late"}])
+
+def test_close_waits_for_readers_in_other_threads(tmp_path):
+    store = MetadataStore(str(tmp_path / "metadata.db"))
+    store.add(list(range(100)), [{"doc_id": str(i % 5), "source": "s", "text": f"chunk {i}"} for i in range(100)])
+    unexpected = []
+
+    def read():
+        while True:
+            try:
+                store.get(list(range(100)))
+                store.documents()
+            except ValueError:
+                return
+            except Exception as e:  # e.g. sqlite3.ProgrammingError: Cannot operate on a closed database
+                unexpected.append(e)
+                return
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    store.close()
+    for reader in readers:
+        reader.join()
+    assert unexpected == []
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+
+from vectordb import VectorDB, VectorStore, index_mode
+
+DIMENSION = 8
+
+def open_db(tmp_path, **options) -> VectorDB:
+    return VectorDB(dimension=DIMENSION, index_path=str(tmp_path / "faiss_index.bin"),
+                    metadata_path=str(tmp_path / "metadata.db"), **options)
+
+def random_vectors(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(n, DIMENSION)).astype('float32')
+
+def chunks(n: int, doc_id: str = "doc") -> list[dict]:
+    return [{"text": f"{doc_id} chunk {i}", "source": f"{doc_id}.pdf", "doc_id": doc_id} for i in range(n)]
+
+def test_rebuild_skips_rows_whose_vectors_were_never_saved(tmp_path):
+    db = open_db(tmp_path, index_mode="ivf_flat", train_threshold=200)
+    db.add(random_vectors(100), chunks(100, "saved"))
+    # Metadata is committed per batch, the index only on save(): a crash here leaves rows without vectors
+    db.add(random_vectors(50, seed=1), chunks(50, "lost"), save=False)
+    db.close()
+
+    db = open_db(tmp_path, index_mode="ivf_flat", train_threshold=200)
+    db.add(random_vectors(120, seed=2), chunks(120, "after"))
+    assert index_mode(db.index) == "ivf_flat"
+    assert db.index.ntotal == 220
+    # And the collection keeps accepting documents
+    db.add(random_vectors(10, seed=3), chunks(10, "later"))
+    assert db.index.ntotal == 230
+
+def test_refresh_keeps_vectors_added_since_the_last_save(tmp_path):
+    db = open_db(tmp_path)
+    db.add(random_vectors(5), chunks(5, "first"))
+    db.add(random_vectors(5, seed=1), chunks(5, "second"), save=False)
+    # Another process (or a clock tick) makes the file look changed
+    db._loaded_mtime = -1
+
+    db.refresh()
+    assert db.index.ntotal == 10
+
+    db.save()
+    db._loaded_mtime = -1
+    db.refresh()
+    assert db.index.ntotal == 10
+
+def test_lookups_do_not_create_collections(tmp_path):
+    store = VectorStore(root=str(tmp_path / "collections"), dimension=DIMENSION)
+    with pytest.raises(KeyError):
+        store.collection("nobody", create=False)
+    assert store.list_collections() == []
+
+    store.collection("notes")
+    assert store.collection("notes", create=False) is store.collection("notes")
+    assert store.list_collections() == ["notes"]
+
+def unit(*values) -> np.ndarray:
+    vector = np.zeros(DIMENSION, dtype='float32')
+    vector[:len(values)] = values
+    return vector / np.linalg.norm(vector)
+
+def test_search_scores_are_cosine_and_min_score_filters(tmp_path):
+    db = open_db(tmp_path)
+    db.add(np.stack([unit(1), unit(1, 1), unit(0, 1)]), chunks(3))
+
+    results = db.search(unit(1), k=3)
+    assert [result["text"] for result in results] == ["doc chunk 0", "doc chunk 1", "doc chunk 2"]
+    assert [round(result["score"], 4) for result in results] == [1.0, round(np.sqrt(0.5), 4), 0.0]
+
+    results = db.search(unit(1), k=3, min_score=0.5)
+    assert [result["text"] for result in results] == ["doc chunk 0", "doc chunk 1"]
+    assert db.search(unit(0, 0, 1), k=3, min_score=0.5) == []
+
+def test_filtered_search_widens_until_enough_matches(tmp_path):
+    db = open_db(tmp_path)
+    # The wanted document ranks below 40 closer vectors of another one
+    db.add(np.stack([unit(1, 0.01 * i) for i in range(40)]), chunks(40, "other"))
+    db.add(np.stack([unit(0.2, 1), unit(0.1, 1)]), chunks(2, "wanted"))
+
+    results = db.search(unit(1), k=2, where={"doc_id": "wanted"})
+    assert [result["text"] for result in results] == ["wanted chunk 0", "wanted chunk 1"]
+
+def test_delete_document_removes_only_its_chunks(tmp_path):
+    db = open_db(tmp_path)
+    ids = db.add(random_vectors(4), chunks(4, "a"))
+    db.add(random_vectors(3, seed=1), chunks(3, "b"))
+    generation = db.generation
+
+    assert db.delete_document("a") == 4
+    assert db.delete_document("a") == 0
+    assert db.index.ntotal == 3
+    assert db.generation != generation
+    assert [doc["doc_id"] for doc in db.documents()] == ["b"]
+    assert {result["doc_id"] for result in db.search(random_vectors(1)[0], k=10)} == {"b"}
+
+    # Ids are never reused, and the deletion survives a reload
+    assert db.add(random_vectors(1, seed=2), chunks(1, "c"))[0] > max(ids)
+    db.close()
+    assert open_db(tmp_path).index.ntotal == 4
+
+def test_mmr_prefers_diverse_results(tmp_path):
+    db = open_db(tmp_path)
+    db.add(np.stack([unit(1, 0.1), unit(1, 0.11), unit(1, 0, 0.6)]), chunks(3))
+
+    assert [r["text"] for r in db.search(unit(1), k=2)] == ["doc chunk 0", "doc chunk 1"]
+    assert [r["text"] for r in db.search(unit(1), k=2, mmr_lambda=0.5)] == ["doc chunk 0", "doc chunk 2"]
+
+def test_max_tokens_caps_results_but_keeps_the_best_one(tmp_path):
+    db = open_db(tmp_path)
+    db.add(np.stack([unit(1), unit(1, 0.1), unit(1, 0.2)]),
+           [{"text": "x" * 400, "doc_id": "d"}, {"text": "y" * 40, "doc_id": "d"}, {"text": "z" * 40, "doc_id": "d"}])
+
+    assert len(db.search(unit(1), k=3, max_tokens=50)) == 1
+    assert len(db.search(unit(1), k=3, max_tokens=120)) == 3
+
+def test_keyword_hits_are_fused_in(tmp_path):
+    db = open_db(tmp_path)
+    db.add(np.stack([unit(1), unit(1, 0.2), unit(0, 1)]),
+           [{"text": "general notes", "doc_id": "d"}, {"text": "more notes", "doc_id": "d"},
+            {"text": "take amoxicillin twice daily", "doc_id": "d"}])
+
+    # Far from the query vector and below min_score, but the only keyword match
+    results = db.search(unit(1), k=3, min_score=0.5, query_text="amoxicillin")
+    assert "take amoxicillin twice daily" in [result["text"] for result in results]
+
+def test_ivf_collection_trains_once_it_crosses_the_threshold(tmp_path):
+    db = open_db(tmp_path, index_mode="ivf_flat", train_threshold=200)
+    db.add(random_vectors(150), chunks(150, "a"))
+    assert index_mode(db.index) == "flat"
+
+    db.add(random_vectors(100, seed=1), chunks(100, "b"))
+    assert index_mode(db.index) == "ivf_flat"
+    assert db.index.is_trained and db.index.ntotal == 250
+
+    # Vectors keep their ids across the rebuild: each one still finds itself
+    probe = random_vectors(100, seed=1)[7]
+    assert db.search(probe, k=1)[0]["text"] == "b chunk 7"
+
+    db.close()
+    reopened = open_db(tmp_path, index_mode="ivf_flat", train_threshold=200)
+    assert index_mode(reopened.index) == "ivf_flat" and reopened.index.ntotal == 250
@@ -1,59 +1,577 @@
 import faiss
+import itertools
 import numpy as np
 import pickle
 import os
+import re
+import shutil
+import threading
+
+from metadata_store import MetadataStore
+
+# Supported index modes:
+# - flat:     exact brute-force search (the baseline)
+# - ivf_flat: inverted lists over k-means cells, exact distances inside probed cells
+# - ivf_pq:   inverted lists with product-quantized vectors (smallest memory footprint)
+# - hnsw:     graph index, no training needed
+INDEX_MODES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# IVF modes are only trained once a collection holds this many vectors;
+# below it the collection stays on an exact flat index.
+DEFAULT_TRAIN_THRESHOLD = 10_000
+
+# Rough cosine-similarity calibration for all-MiniLM-L6-v2: unrelated text
+# scores around 0.0-0.2, loosely related text 0.2-0.35 and genuine matches above that.
+DEFAULT_MIN_SCORE = 0.3
+
+# Source of VectorDB.generation values
+_generations = itertools.count(1)
+
+def create_index(mode: str, dimension: int, n_vectors: int = 0, nlist: int | None = None, pq_m: int = 48, hnsw_m: int = 32,
+                 metric: int = faiss.METRIC_INNER_PRODUCT):
+    """
+    Builds an empty FAISS index for `mode`.
+    Every index returned here accepts add_with_ids(), so vector ids stay stable across modes.
+    IVF indexes still need to be trained before vectors can be added.
+    With the default inner-product metric and normalized vectors, scores are cosine similarities.
+    """
+    if mode == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlat(dimension, metric))
+    if mode == "hnsw":
+        return faiss.IndexIDMap2(faiss.IndexHNSWFlat(dimension, hnsw_m, metric))
+    if mode in ("ivf_flat", "ivf_pq"):
+        if nlist is None:
+            # ~4*sqrt(n) cells, with at least 39 training points per cell as FAISS recommends
+            nlist = max(1, min(int(4 * np.sqrt(max(n_vectors, 1))), n_vectors // 39))
+        quantizer = faiss.IndexFlat(dimension, metric)
+        if mode == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, 8, metric)
+        # Hand the quantizer over to the index so it lives exactly as long as the index does
+        index.own_fields = True
+        quantizer.this.disown()
+        # A hashtable direct map lets IVF indexes reconstruct and remove by arbitrary id
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return index
+    raise ValueError(f"Unknown index mode: {mode!r} (expected one of {', '.join(INDEX_MODES)})")
+
+def index_mode(index) -> str:
+    """
+    Returns which of INDEX_MODES an index was built as.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap2):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    return "flat"
+
+def index_ids(index) -> np.ndarray:
+    """
+    Returns the ids of every vector an index from create_index() holds (including HNSW tombstones).
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap2):
+        return faiss.vector_to_array(index.id_map).astype('int64')
+    invlists = faiss.extract_index_ivf(index).invlists
+    ids = [faiss.rev_swig_ptr(invlists.get_ids(cell), invlists.list_size(cell)).copy()
+           for cell in range(invlists.nlist) if invlists.list_size(cell)]
+    return np.concatenate(ids).astype('int64') if ids else np.empty(0, dtype='int64')
 
 class VectorDB:
-    def __init__(self, dimension: int = 384, index_path: str = "data/faiss_index.bin", metadata_path: str = "data/metadata.pkl"):
+    """
+    A single collection of vectors.
+    Every vector has a stable integer id, so documents can be added and
+    removed without rebuilding the rest of the collection.
+
+    Vectors are L2-normalized on the way in and searched by inner product,
+    so every score is a cosine similarity in [-1, 1].
+
+    `index_mode` selects the FAISS index (see INDEX_MODES). IVF modes start
+    out on a flat index and are trained automatically once the collection
+    reaches `train_threshold` vectors. `nprobe` (IVF) and `ef_search` (HNSW)
+    trade recall for latency at search time.
+    """
+    def __init__(self, dimension: int = 384, index_path: str = "data/faiss_index.bin", metadata_path: str = "data/metadata.db",
+                 index_mode: str = "flat", nprobe: int = 16, ef_search: int = 64, train_threshold: int = DEFAULT_TRAIN_THRESHOLD):
+        if index_mode not in INDEX_MODES:
+            raise ValueError(f"Unknown index mode: {index_mode!r} (expected one of {', '.join(INDEX_MODES)})")
         self.dimension = dimension
         self.index_path = index_path
         self.metadata_path = metadata_path
-        self.metadata = []  # List of dicts: [{"text": "...", "source": "..."}]
-        
-        if os.path.exists(index_path) and os.path.exists(metadata_path):
-            self.index = faiss.read_index(index_path)
-            with open(metadata_path, "rb") as f:
-                self.metadata = pickle.load(f)
-        else:
-            self.index = faiss.IndexFlatL2(dimension)
+        self.index_mode = index_mode
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.train_threshold = train_threshold
+        self.next_id = 0
 
-    def add(self, embeddings: list[list[float]], metadatas: list[dict]):
+        # Metadata rows ({"text": "...", "source": "...", "doc_id": "..."}) keyed by FAISS id
+        os.makedirs(os.path.dirname(metadata_path) or ".", exist_ok=True)
+        self.store = MetadataStore(metadata_path)
+        self._import_legacy_metadata()
+
+        # Changes every time the in-memory index changes (add, delete, reset or reload),
+        # so callers can tell whether anything they derived from it is stale.
+        # Drawn from a process-wide counter, so a dropped and re-created collection never repeats one.
+        self.generation = next(_generations)
+        self._lock = threading.RLock()
+        self._loaded_mtime = None
+        # Set while the in-memory index has vectors save() has not written yet
+        self._unsaved = False
+
+        self.index = self._new_index()
+        self.reload()
+
+    def _new_index(self):
+        return create_index("flat" if self.index_mode.startswith("ivf") else self.index_mode, self.dimension)
+
+    def _target_mode(self, n_vectors: int) -> str:
         """
-        Adds embeddings and metadata to the index.
+        The mode the index should be in for a collection of this size.
+        """
+        if self.index_mode.startswith("ivf") and n_vectors < self.train_threshold:
+            return "flat"
+        return self.index_mode
+
+    def _apply_search_params(self, index):
+        mode = index_mode(index)
+        if mode.startswith("ivf"):
+            faiss.extract_index_ivf(index).nprobe = self.nprobe
+        elif mode == "hnsw":
+            faiss.downcast_index(index.index).hnsw.efSearch = self.ef_search
+        return index
+
+    def set_search_params(self, nprobe: int | None = None, ef_search: int | None = None):
+        """
+        Tunes the recall/latency trade-off of approximate modes at runtime.
+        """
+        with self._lock:
+            if nprobe is not None:
+                self.nprobe = nprobe
+            if ef_search is not None:
+                self.ef_search = ef_search
+            self._apply_search_params(self.index)
+
+    def _rebuild(self, mode: str):
+        """
+        Re-indexes every live vector into a fresh index of `mode`.
+        Used to train IVF once enough vectors exist and to compact away
+        tombstones left by indexes that cannot remove vectors in place.
         """
-        if not embeddings:
+        # Only ids the index actually holds: rows committed before a crash (or by another process
+        # whose save this one has not loaded) have no vector here to re-index
+        ids = np.array(self.store.find_ids(), dtype='int64')
+        ids = ids[np.isin(ids, index_ids(self.index))]
+        vectors = _normalize(self.index.reconstruct_batch(ids)) if len(ids) else np.empty((0, self.dimension), dtype='float32')
+
+        print(f"Rebuilding {self.index_path} as {mode} with {len(ids)} vectors...")
+        index = create_index(mode, self.dimension, n_vectors=len(ids))
+        if not index.is_trained:
+            index.train(vectors)
+        if len(ids):
+            index.add_with_ids(vectors, ids)
+        self.index = self._apply_search_params(index)
+
+    def _maybe_rebuild(self):
+        """
+        Rebuilds the index if its mode or metric is out of date or too much of it is deleted.
+        """
+        live = self.store.count()
+        tombstones = self.index.ntotal - live
+        target = self._target_mode(live)
+        outdated = index_mode(self.index) != target or self.index.metric_type != faiss.METRIC_INNER_PRODUCT
+        if outdated or (tombstones and tombstones > 0.2 * self.index.ntotal):
+            self._rebuild(target)
+            return True
+        return False
+
+    def _disk_mtime(self):
+        """
+        Returns the modification time of the persisted index, or None if nothing is on disk.
+        Metadata needs no check: every process reads it live from SQLite.
+        """
+        try:
+            return os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _import_legacy_metadata(self):
+        """
+        Moves metadata from the old pickle format (a list or {id: dict}) into the SQLite store.
+        """
+        legacy_path = os.path.splitext(self.metadata_path)[0] + ".pkl"
+        if not os.path.exists(legacy_path) or self.store.count():
             return
-        
-        vectors = np.array(embeddings).astype('float32')
-        self.index.add(vectors)
-        self.metadata.extend(metadatas)
-        self.save()
+        with open(legacy_path, "rb") as f:
+            metadata = pickle.load(f)
+        if isinstance(metadata, list):
+            metadata = dict(enumerate(metadata))
+        self.store.add(list(metadata), list(metadata.values()))
+        os.remove(legacy_path)
+
+    def reload(self):
+        """
+        Loads the index from disk.
+        It is read before anything is swapped in, so concurrent searches
+        see either the old state or the new one, never a mix.
+        """
+        mtime = self._disk_mtime()
+        if mtime is None:
+            index = self._new_index()
+        else:
+            index = faiss.read_index(self.index_path)
+            if index.d != self.dimension:
+                raise ValueError(f"Index {self.index_path} holds {index.d}-dimensional vectors, expected {self.dimension}; "
+                                 "it was built with a different embedding model")
+
+            # Older indexes were a plain IndexFlatL2 addressed by position
+            if isinstance(faiss.downcast_index(index), faiss.IndexFlat):
+                vectors = _normalize(index.reconstruct_n(0, index.ntotal)) if index.ntotal else np.empty((0, self.dimension), dtype='float32')
+                index = create_index("flat", self.dimension)
+                index.add_with_ids(vectors, np.arange(len(vectors), dtype='int64'))
+            self._apply_search_params(index)
+
+        with self._lock:
+            self.index = index
+            self.next_id = max(self.store.max_id() + 1, self.next_id)
+            self._loaded_mtime = mtime
+            self._unsaved = False
+            # Indexes written before the switch to cosine similarity are L2 over raw vectors
+            if self.index.metric_type != faiss.METRIC_INNER_PRODUCT:
+                self._rebuild(self._target_mode(self.store.count()))
+                self.save()
+            self.generation = next(_generations)
+
+    def refresh(self) -> int:
+        """
+        Reloads from disk only if the persisted index changed since the last load or save.
+        This is a single stat() call on the hot path instead of a full read.
+        Never reloads over vectors added with save=False: the file is older than they are,
+        and swapping it in would lose them while their metadata stayed behind.
+        Returns the current generation.
+        """
+        # Checked and swapped under the lock, so an add() cannot slip in between
+        with self._lock:
+            if not self._unsaved and self._disk_mtime() != self._loaded_mtime:
+                self.reload()
+            return self.generation
+
+    def reset(self):
+        """
+        Drops every vector and removes the persisted index.
+        """
+        with self._lock:
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            self.store.clear()
+            self.index = self._new_index()
+            self.next_id = 0
+            self._loaded_mtime = None
+            self._unsaved = False
+            self.generation = next(_generations)
+
+    def close(self):
+        # Waits for any add, delete or search in progress
+        with self._lock:
+            self.store.close()
 
-    def search(self, query_vector: list[float], k: int = 5, threshold: float = 1.5) -> list[dict]:
+    def add(self, embeddings: np.ndarray, metadatas: list[dict], save: bool = True) -> list[int]:
         """
-        Searches for the k nearest neighbors.
-        Returns only results with distance < threshold.
+        Adds embeddings and metadata to the index.
+        Only the new vectors are indexed and only their metadata rows are written.
+        Pass save=False when adding many batches in a row and call save() once at the end.
+        Returns the ids assigned to the new vectors.
         """
-        if self.index.ntotal == 0:
+        if len(embeddings) == 0:
             return []
-            
-        vector = np.array([query_vector]).astype('float32')
-        distances, indices = self.index.search(vector, k)
-        
-        results = []
-        for i, idx in enumerate(indices[0]):
-            dist = distances[0][i]
-            if idx != -1 and idx < len(self.metadata):
-                # Only include if distance is low enough (relevant)
-                if dist < threshold:
-                    results.append(self.metadata[idx])
-                
+
+        vectors = _normalize(embeddings)
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(f"Got {vectors.shape[1]}-dimensional embeddings for a {self.dimension}-dimensional index")
+        with self._lock:
+            ids = np.arange(self.next_id, self.next_id + len(vectors), dtype='int64')
+            self.index.add_with_ids(vectors, ids)
+            self.next_id += len(vectors)
+            self.store.add(ids.tolist(), metadatas)
+            self._maybe_rebuild()
+            self.generation = next(_generations)
+            if save:
+                self.save()
+            else:
+                self._unsaved = True
+        return ids.tolist()
+
+    def delete(self, where: dict) -> int:
+        """
+        Removes every vector whose metadata matches `where`.
+        Returns the number of vectors removed.
+        """
+        with self._lock:
+            ids = self.store.find_ids(where)
+            if not ids:
+                return 0
+            try:
+                self.index.remove_ids(np.array(ids, dtype='int64'))
+            except RuntimeError:
+                # HNSW cannot remove vectors; they stay in the graph as tombstones that
+                # search skips (no metadata) until _maybe_rebuild() compacts them away
+                pass
+            self.store.delete(ids)
+            self._maybe_rebuild()
+            self.generation = next(_generations)
+            self.save()
+        return len(ids)
+
+    def delete_document(self, doc_id: str) -> int:
+        """
+        Removes all chunks of one document.
+        """
+        return self.delete({"doc_id": doc_id})
+
+    def documents(self) -> list[dict]:
+        """
+        Lists the documents in this collection with their chunk counts.
+        """
+        return self.store.documents()
+
+    def search(self, query_vector: list[float], k: int = 5, min_score: float | None = None, where: dict | None = None,
+               mmr_lambda: float | None = None, fetch_k: int | None = None, max_tokens: int | None = None,
+               count_tokens=None, query_text: str | None = None, rrf_k: int = 60, rerank=None) -> list[dict]:
+        """
+        Searches for the k most similar chunks.
+        Each result is the chunk metadata plus its cosine similarity under "score".
+
+        - min_score: drop results below this similarity (see DEFAULT_MIN_SCORE).
+        - where: only return results whose metadata matches it
+          (e.g. {"doc_id": "..."} or {"source": ["a.pdf", "b.pdf"]}).
+        - mmr_lambda: re-rank the top `fetch_k` candidates with Maximal Marginal
+          Relevance, trading relevance (1.0) against diversity (0.0).
+        - max_tokens: stop adding results once their texts would exceed this many
+          tokens, counted with `count_tokens` (defaults to a ~4 chars/token estimate).
+        - query_text: also run a BM25 keyword search for it and merge both rankings with
+          Reciprocal Rank Fusion (score = sum of 1 / (rrf_k + rank)). Keyword hits are kept
+          even below min_score, since that is where exact or misspelled terms beat embeddings.
+        - rerank: a (query_text, texts) -> scores function, e.g. a cross-encoder,
+          used to reorder the fused candidates before MMR and the token cap.
+
+        Only the metadata rows of the candidates are read.
+        """
+        vector = _normalize(query_vector)
+        want = max(k, fetch_k or (k * 4 if mmr_lambda is not None else k))
+        with self._lock:
+            total = self.index.ntotal
+            if total == 0:
+                return []
+
+            # With a filter, over-fetch and widen until enough matches are found or the whole collection was scanned
+            fetch = min(total, want if not where else want * 4)
+            while True:
+                scores, indices = self.index.search(vector, fetch)
+                candidates = [(float(score), int(idx)) for score, idx in zip(scores[0], indices[0])
+                              if idx != -1 and (min_score is None or score >= min_score)]
+                metadata = self.store.get([idx for _, idx in candidates])
+                hits = [(score, idx, metadata[idx]) for score, idx in candidates
+                        if idx in metadata and (not where or _matches(metadata[idx], where))]
+                # Results come back best first, so once they fall below min_score widening cannot help
+                exhausted = min_score is not None and indices[0][-1] != -1 and scores[0][-1] < min_score
+                if len(hits) >= want or fetch >= total or exhausted:
+                    break
+                fetch = min(total, fetch * 4)
+
+            hits = hits[:want]
+            # How relevant each hit is, for MMR; cosine similarity unless fusion or reranking says otherwise
+            relevance = None
+            if query_text:
+                hits, relevance = self._fuse(vector[0], hits, self.store.keyword_search(query_text, want, where), rrf_k)
+                hits, relevance = hits[:want], relevance[:want]
+
+            if rerank is not None and query_text and hits:
+                scores = np.asarray(rerank(query_text, [meta["text"] or "" for _, _, meta in hits]), dtype='float32')
+                order = np.argsort(-scores, kind="stable")
+                hits, relevance = [hits[i] for i in order], _rescale(scores[order])
+
+            if mmr_lambda is not None and len(hits) > k:
+                vectors = self.index.reconstruct_batch(np.array([idx for _, idx, _ in hits], dtype='int64'))
+                hits = _mmr(vector[0], _normalize(vectors), hits, k, mmr_lambda, relevance)
+
+        count_tokens = count_tokens or _approx_tokens
+        results, used = [], 0
+        for score, _, meta in hits[:k]:
+            if max_tokens is not None:
+                used += count_tokens(meta["text"] or "")
+                if used > max_tokens and results:
+                    break
+            results.append({**meta, "score": score})
+
         return results
 
+    def _fuse(self, query: np.ndarray, dense: list, keyword: list[tuple[int, float]], rrf_k: int) -> tuple[list, np.ndarray]:
+        """
+        Reciprocal Rank Fusion of vector hits and keyword hits.
+        Returns the merged (cosine, id, metadata) hits, best first, and their fused scores scaled to [0, 1].
+        """
+        fused, found = {}, {idx: (score, meta) for score, idx, meta in dense}
+        for rank, (_, idx, _) in enumerate(dense):
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (rrf_k + rank + 1)
+        for rank, (idx, _) in enumerate(keyword):
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (rrf_k + rank + 1)
+
+        # Keyword-only hits still need their metadata and a cosine score
+        missing = [idx for idx in fused if idx not in found]
+        if missing:
+            metadata = self.store.get(missing)
+            for idx in [idx for idx in missing if idx in metadata]:
+                try:
+                    vector = _normalize(self.index.reconstruct(int(idx)))
+                except RuntimeError:
+                    # Row committed by another process whose index save this one has not loaded yet
+                    continue
+                found[idx] = (float(vector[0] @ query), metadata[idx])
+
+        order = sorted((idx for idx in fused if idx in found), key=lambda idx: -fused[idx])
+        hits = [(found[idx][0], idx, found[idx][1]) for idx in order]
+        return hits, _rescale(np.array([fused[idx] for idx in order], dtype='float32'))
+
     def save(self):
         """
-        Saves the index and metadata to disk.
+        Saves the index to disk (metadata rows are already committed by add/delete).
+        The file is written next to its target and renamed into place, so a
+        reader in another process never picks up a half-written index.
+        """
+        with self._lock:
+            os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+            faiss.write_index(self.index, self.index_path + ".tmp")
+            os.replace(self.index_path + ".tmp", self.index_path)
+            self._loaded_mtime = self._disk_mtime()
+            self._unsaved = False
+
+
+class VectorStore:
+    """
+    Named collections of VectorDBs, each persisted in its own directory.
+    Collections are opened on first use and then kept in memory for the
+    lifetime of the process, so many users can keep their own memory side by side.
+    """
+    def __init__(self, root: str = "data/collections", dimension: int = 384, **index_options):
+        self.root = root
+        self.dimension = dimension
+        self.index_options = index_options  # Forwarded to every VectorDB (index_mode, nprobe, ...)
+        self.collections = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._adopt_legacy_index()
+
+    def _adopt_legacy_index(self):
+        """
+        Moves a pre-collections index (data/faiss_index.bin + data/metadata.pkl) into the default collection.
+        """
+        parent = os.path.dirname(self.root.rstrip("/")) or "."
+        legacy = [os.path.join(parent, "faiss_index.bin"), os.path.join(parent, "metadata.pkl")]
+        target = self._path("default")
+        if all(os.path.exists(path) for path in legacy) and not os.path.exists(target):
+            os.makedirs(target)
+            for path in legacy:
+                shutil.move(path, os.path.join(target, os.path.basename(path)))
+
+    def _path(self, name: str) -> str:
+        if not re.fullmatch(r"[A-Za-z0-9_\-]{1,64}", name):
+            raise ValueError(f"Invalid collection name: {name!r}")
+        return os.path.join(self.root, name)
+
+    def collection(self, name: str = "default", create: bool = True) -> VectorDB:
+        """
+        Returns the collection with this name, creating it if needed.
+        With create=False an unknown collection raises KeyError instead, so read-only
+        requests do not leave a directory and database behind for every name they try.
         """
-        faiss.write_index(self.index, self.index_path)
-        with open(self.metadata_path, "wb") as f:
-            pickle.dump(self.metadata, f)
+        path = self._path(name)
+        with self._lock:
+            if name not in self.collections:
+                if not create and not os.path.isdir(path):
+                    raise KeyError(f"Unknown collection: {name}")
+                self.collections[name] = VectorDB(
+                    dimension=self.dimension,
+                    index_path=os.path.join(path, "faiss_index.bin"),
+                    metadata_path=os.path.join(path, "metadata.db"),
+                    **self.index_options,
+                )
+            return self.collections[name]
+
+    def list_collections(self) -> list[str]:
+        with self._lock:
+            on_disk = {name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name))}
+            return sorted(on_disk | set(self.collections))
+
+    def drop_collection(self, name: str):
+        """
+        Deletes a collection and everything persisted for it.
+        """
+        path = self._path(name)
+        with self._lock:
+            db = self.collections.pop(name, None)
+            if db is not None:
+                db.reset()
+                db.close()
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+
+
+def _matches(meta: dict, where: dict) -> bool:
+    """
+    True if every key in `where` equals the metadata value (or is one of them, for list values).
+    """
+    for key, expected in where.items():
+        value = meta.get(key)
+        if isinstance(expected, (list, tuple, set)):
+            if value not in expected:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+def _normalize(vectors) -> np.ndarray:
+    """
+    Returns a float32 (n, d) copy of `vectors` scaled to unit length.
+    """
+    vectors = np.array(vectors, dtype='float32', ndmin=2)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def _mmr(query: np.ndarray, vectors: np.ndarray, hits: list, k: int, mmr_lambda: float,
+         relevance: np.ndarray | None = None) -> list:
+    """
+    Greedy Maximal Marginal Relevance: repeatedly picks the candidate most relevant
+    to the query and least similar to anything already picked.
+    Relevance defaults to cosine similarity with the query.
+    """
+    if relevance is None:
+        relevance = vectors @ query
+    pairwise = vectors @ vectors.T
+    selected, remaining = [], list(range(len(hits)))
+    while remaining and len(selected) < k:
+        if selected:
+            redundancy = pairwise[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy
+        best = remaining[int(np.argmax(scores))]
+        selected.append(best)
+        remaining.remove(best)
+    return [hits[i] for i in selected]
+
+def _rescale(scores: np.ndarray) -> np.ndarray:
+    """
+    Min-max scales scores to [0, 1], so they are comparable with cosine similarities in MMR.
+    """
+    if len(scores) == 0:
+        return scores
+    spread = scores.max() - scores.min()
+    return (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
@@ -1,12 +1,13 @@
-import insightface
-from insightface.app import FaceAnalysis
 import cv2
 import numpy as np
 
+from face_analysis import face_analysis, FaceAnalysisProvider, ANALYZE_MODULES
+
 class WanModel:
     def __init__(self, model_name="buffalo_l"):
-        self.app = FaceAnalysis(name=model_name)
-        self.app.prepare(ctx_id=0, det_size=(640, 640))
+        # Shares its detector with face swap; only adds the age/gender and 3D landmark (pose) models
+        provider = face_analysis if model_name == face_analysis.name else FaceAnalysisProvider(model_name)
+        self.app = provider.get(ANALYZE_MODULES)
         
     def predict(self, image_path):
         img = cv2.imread(image_path)
@@ -1,5 +1,9 @@
 const API_URL = "http://localhost:8000";
 
+// Upload status polling: consecutive failed requests, and total time, before giving up
+const MAX_POLL_FAILURES = 5;
+const MAX_INDEXING_WAIT_MS = 30 * 60 * 1000;
+
 export const chatStream = async (message, history, onChunk) => {
     try {
         const response = await fetch(`${API_URL}/chat`, {
@@ -38,7 +42,35 @@ export const uploadFile = async (file) => {
             method: "POST",
             body: formData,
         });
-        return await response.json();
+        let job = await response.json();
+
+        // Indexing runs in the background; wait for it so the next chat sees the file.
+        // Gives up if the job is gone (server restarted), the server stops answering, or it takes too long
+        const deadline = Date.now() + MAX_INDEXING_WAIT_MS;
+        let failures = 0;
+        while (job.job_id && !["done", "error"].includes(job.status)) {
+            if (Date.now() > deadline) {
+                return { ...job, status: "error", error: "Timed out waiting for indexing." };
+            }
+            await new Promise((resolve) => setTimeout(resolve, 1000));
+            try {
+                const status = await fetch(`${API_URL}/upload/${job.job_id}`);
+                if (status.status === 404) {
+                    return { ...job, status: "error", error: "Upload job no longer exists." };
+                }
+                if (!status.ok) {
+                    throw new Error(`Status request failed: ${status.status}`);
+                }
+                job = await status.json();
+                failures = 0;
+            } catch (error) {
+                failures += 1;
+                if (failures >= MAX_POLL_FAILURES) {
+                    throw error;
+                }
+            }
+        }
+        return job;
     } catch (error) {
         console.error("Error uploading:", error);
         return { message: "Error uploading file." };